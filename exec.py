@@ -8,12 +8,17 @@
 # pyinstaller --name wezel --clean --additional-hooks-dir=. exec.py
 
 
+import multiprocessing
+
 import wezel
 import numpy as np
 
 
 if __name__ == "__main__":
 
+    # Needed for the pool of processes that reads DICOM headers
+    multiprocessing.freeze_support()
+
     # This closes the splash screen
     # pyi_splash is part of pyinstaller
     try:
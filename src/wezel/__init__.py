@@ -2,5 +2,6 @@ from wezel.core import Action, MainWidget
 from wezel.main import app
 import wezel.menu
 import wezel.widgets
+import wezel.jobs
 import wezel.menus
 
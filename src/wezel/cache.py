@@ -0,0 +1,305 @@
+"""
+`cache` keeps decoded pixel data in memory, or memory-mapped on disk,
+so that viewers do not need to decode the same DICOM files more than once.
+
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtCore import QObject, QThreadPool
+from dbdicom.ds.create import read_dataset
+
+from wezel import jobs
+from wezel.widgets.log_to_GUI import Worker
+
+
+def read_slice(image):
+    """Read the pixel array and display settings of an image.
+
+    The file is read only once and the image is not kept in memory
+    by the database. Returns a dictionary with the array, the window
+    center and width and the colormap.
+    """
+    return _slice(image.get_dataset())
+
+
+def read_slice_file(file):
+    """Read the pixel array and display settings from a DICOM file.
+
+    As read_slice(), but the file is read directly, without going 
+    through the database.
+    """
+    try:
+        ds = read_dataset(file)
+    except FileNotFoundError:
+        ds = None
+    return _slice(ds)
+
+
+def image_file(image):
+    """Path to the file of an image, or None if it has changes in memory"""
+    manager = image.manager
+    key = image.keys()[0]
+    if (key in manager.dataset) or (manager.path is None):
+        return
+    return manager.filepath(key)
+
+
+def _slice(ds):
+    if ds is None:
+        return {'array': None, 'center': None, 'width': None, 'colormap': None}
+    center, width, colormap = ds.get_values(['WindowCenter', 'WindowWidth', 'colormap'])
+    return {
+        'array': ds.get_pixel_array(),
+        'center': center,
+        'width': width,
+        'colormap': colormap,
+    }
+
+
+class SliceCache():
+    """Least-recently-used cache of decoded slices with a memory budget.
+
+    Slices are dictionaries as returned by read_slice(), keyed by
+    SOPInstanceUID. When the total size of the cached arrays exceeds
+    maxBytes, the least recently used slices are removed.
+    """
+
+    def __init__(self, maxBytes=256*2**20):
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, uid):
+        return uid in self._slices
+
+    def __len__(self):
+        return len(self._slices)
+
+    def get(self, uid):
+        with self._lock:
+            slice = self._slices.get(uid)
+            if slice is not None:
+                self._slices.move_to_end(uid)
+            return slice
+
+    def set(self, uid, slice):
+        if slice['array'] is None:
+            return
+        with self._lock:
+            self._remove(uid)
+            self._slices[uid] = slice
+            self.nbytes += slice['array'].nbytes
+            while self.nbytes > self.maxBytes and len(self._slices) > 1:
+                self._remove(next(iter(self._slices)))
+
+    def remove(self, uid):
+        with self._lock:
+            self._remove(uid)
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self.nbytes = 0
+
+    def _remove(self, uid):
+        slice = self._slices.pop(uid, None)
+        if slice is not None:
+            self.nbytes -= slice['array'].nbytes
+
+
+class SlicePrefetcher(QObject):
+    """Reads slices on a thread pool and stores them in a SliceCache.
+
+    Each call to prefetch() supersedes the previous one: slices that
+    were requested earlier but have not started loading are skipped.
+
+    The database is not thread-safe, so the paths of the files are 
+    looked up in the calling thread and the threads only read the 
+    files, and not while a job is running. Images with changes in 
+    memory are not prefetched.
+    """
+
+    def __init__(self, cache, maxThreadCount=2):
+        super().__init__()
+        self.cache = cache
+        self._pending = set()
+        self._wanted = set()
+        self.threadPool = QThreadPool()
+        self.threadPool.setMaxThreadCount(maxThreadCount)
+
+    def prefetch(self, images):
+        self._wanted = set([image.uid for image in images])
+        for image in images:
+            uid = image.uid
+            if (uid in self.cache) or (uid in self._pending):
+                continue
+            file = image_file(image)
+            if file is None:
+                continue
+            self._pending.add(uid)
+            worker = Worker(self._read, uid, file)
+            worker.signals.result.connect(lambda slice, uid=uid: self._store(uid, slice))
+            worker.signals.finished.connect(lambda uid=uid: self._pending.discard(uid))
+            self.threadPool.start(worker)
+
+    def cancel(self):
+        self._wanted = set()
+        self._pending = set()
+        self.threadPool.clear()
+
+    def _read(self, uid, file, signals=None):
+        if uid not in self._wanted:
+            return
+        with jobs.reading():
+            return read_slice_file(file)
+
+    def _store(self, uid, slice):
+        if slice is not None:
+            self.cache.set(uid, slice)
+
+
+class VolumeCache():
+    """Persistent cache of decoded series on disk.
+
+    Pixel arrays are saved as .npy files and opened memory-mapped, so
+    that reopening a series only reads the pages that are actually
+    accessed. A cache entry is identified by the SeriesInstanceUID, the 
+    layout of the array and the modification times of the DICOM files, 
+    so entries become stale automatically when the files change. When 
+    the total size exceeds maxBytes, the least recently used entries 
+    are deleted. With maxBytes=0 nothing is cached.
+    """
+
+    def __init__(self, path=None, maxBytes=4*2**30):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.wezel', 'cache')
+        self.path = path
+        self.maxBytes = maxBytes
+
+    def file(self, series, *args):
+        """Path to the cache file of a series.
+
+        Any additional arguments identify the layout of the array,
+        such as the sort order. Returns None if the series cannot be 
+        cached, for instance because it has changes in memory that 
+        are not saved to disk, or if the cache is disabled.
+        """
+        manager = series.manager
+        if manager.path is None or self.maxBytes == 0:
+            return
+        keys = series.keys()
+        if len(keys) == 0:
+            return
+        hash = hashlib.sha1()
+        hash.update(repr(args).encode())
+        for key in sorted(keys):
+            if key in manager.dataset:
+                return
+            try:
+                stat = os.stat(manager.filepath(key))
+            except OSError:
+                return
+            hash.update((key + str(stat.st_mtime_ns) + str(stat.st_size)).encode())
+        return os.path.join(self.path, series.uid + '_' + hash.hexdigest() + '.npy')
+
+    def load(self, file):
+        """Open a cache file memory-mapped and read-only.
+
+        Returns None if the file does not exist or cannot be read.
+        """
+        if file is None or not os.path.exists(file):
+            return
+        try:
+            array = np.load(file, mmap_mode='r')
+        except (OSError, ValueError):
+            self._delete(file)
+            return
+        # Mark the file as recently used
+        os.utime(file)
+        return array
+
+    def save(self, file, array):
+        """Save an array to a cache file.
+
+        Nothing is saved if the cache directory cannot be written.
+        """
+        tmp = file + '.tmp'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp, file)
+        except OSError:
+            self._delete(tmp)
+            return
+        self.evict(keep=file)
+
+    def evict(self, keep=None):
+        """Delete least recently used files until the cache fits in maxBytes"""
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum([f[1] for f in files])
+        for _, size, file in sorted(files):
+            if total <= self.maxBytes:
+                break
+            if file != keep:
+                if self._delete(file):
+                    total -= size
+
+    def invalidate(self, uids=None):
+        """Delete the cached series with the given SeriesInstanceUIDs.
+
+        If uids is None, the cache is emptied.
+        """
+        if not os.path.isdir(self.path):
+            return
+        if uids is not None:
+            uids = set(uids)
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.npy'):
+                continue
+            if (uids is None) or (entry.name.rsplit('_', 1)[0] in uids):
+                self._delete(entry.path)
+
+    def _delete(self, file):
+        # Files that are still mapped cannot be deleted on some platforms.
+        try:
+            os.remove(file)
+        except OSError:
+            return False
+        return True
+
+
+def modified_series(database):
+    """SeriesInstanceUIDs of all series with unsaved changes"""
+    df = database.manager.register
+    return df.SeriesInstanceUID[df.created | df.removed].unique().tolist()
+
+
+def all_series(database):
+    """SeriesInstanceUIDs of all series in the database"""
+    return database.manager.register.SeriesInstanceUID.unique().tolist()
+
+
+def set_volumes(path=None, maxBytes=4*2**30):
+    """Use a new cache of decoded series.
+
+    path is the cache directory (default ~/.wezel/cache) and maxBytes
+    its maximum size. With maxBytes=0 series are not cached. Returns 
+    the cache that was used before.
+    """
+    global volumes
+    previous = volumes
+    volumes = VolumeCache(path, maxBytes)
+    return previous
+
+
+volumes = VolumeCache()
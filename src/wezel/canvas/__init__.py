@@ -8,8 +8,24 @@ from wezel.canvas.utils import (
     colormap_to_LUT,
     region_grow_add, 
     region_grow_remove,
+    region_connected,
+    brush_stencil,
+    brush_stroke,
+    bounding_box,
 )
 
+from wezel.canvas.render import (
+    ImageRenderer,
+)
+from wezel.canvas.history import (
+    MaskHistory,
+)
+from wezel.canvas.statistics import (
+    ImageStatistics,
+)
+from wezel.canvas.region import (
+    Region,
+)
 from wezel.canvas.canvas import (
     Canvas,
     ImageItem,
@@ -1,6 +1,5 @@
 import random
 import numpy as np
-import copy
 
 
 from PyQt5.QtCore import Qt, pyqtSignal, QRectF
@@ -9,7 +8,10 @@ from PyQt5.QtWidgets import (QGraphicsObject, QGraphicsItem,
 from PyQt5.QtGui import QPixmap, QBrush, QIcon, QTransform, QCursor, QImage
 
 from wezel import canvas, icons
-from wezel.canvas.utils import colormap_to_LUT
+from wezel.canvas.utils import colormap_to_LUT, bounding_box
+from wezel.canvas.render import ImageRenderer
+from wezel.canvas.history import MaskHistory
+from wezel.canvas.statistics import ImageStatistics
 
 class Canvas(QGraphicsView):
     """Wrapper for ImageItem displaying it in a scrollable Widget"""
@@ -117,9 +119,9 @@ class Canvas(QGraphicsView):
 
     def setWindow(self, center=None, width=None):
         if (center is None) or (width is None):
-            array = self.imageItem._array
-            min = np.min(array)
-            max = np.max(array)
+            stats = self.imageItem.stats
+            min = stats.min()
+            max = stats.max()
         if center is None:
             center = (max+min)/2
         if width is None:
@@ -172,6 +174,7 @@ class ImageItem(AnyItem):
         super().__init__()
         #self.setFlag(QGraphicsItem.ItemIsSelectable)
         self.setOpacity(1.0)
+        self._renderer = ImageRenderer()
         self.setData(array, center, width, lut)
         self.setDisplay()
 
@@ -188,60 +191,45 @@ class ImageItem(AnyItem):
             self.setLUT(lut)
         except: # image is corrupted
             self._array = None
+            self.stats = None
             self._width = None
             self._center = None  
             self._cmap = None
             self._lut = None 
-            self._array_scaled = None
             self._BGRA = None
             self._qImage = None 
         
     def setArray(self, array):
         self._array = array
+        self.stats = ImageStatistics(array)
         nx, ny = array.shape[0], array.shape[1]
         if nx is None: # image is corrupted
             nx, ny = 0, 0
         self.boundingRectangle = QRectF(0, 0, nx, ny)
-        self._BGRA = np.empty((ny, nx, 4), dtype=np.ubyte)
-        self._BGRA[:,:,3] = 0 
+        self._renderer.setArray(array, self.stats.min(), self.stats.max())
+        self._BGRA = self._renderer.BGRA
         # QImage points to self._BGRA in memory - does not need to be updated
         self._qImage = QImage(self._BGRA, self._BGRA.shape[1], self._BGRA.shape[0], QImage.Format_RGB32)
 
     def setWindow(self, center, width):
         self._width = width
         self._center = center
-        max = center + width/2
-        min = center - width/2
-        # Scale pixel array into byte range
-        array = np.clip(self._array, min, max)
-        array -= min
-        if max > min:
-            scale = 255/(max-min)
-            array *= scale
-        # QImage expects the array transposed
-        self._array_scaled = array.astype(np.ubyte)
-        self._array_scaled = np.transpose(self._array_scaled)
+        self._renderer.setWindow(center, width)
 
     def setLUT(self, lut):
         #LUT is lookup table with values in range [0,1]
         if lut is None:
             self._lut = None
         else:
-            # Create RGB array by indexing LUT with pixel array
             lut = 255*lut 
-            self._lut = lut.astype(np.ubyte)     
+            self._lut = lut.astype(np.ubyte)   
+        self._renderer.setLUT(self._lut)  
 
     def setDisplay(self):
         if self._BGRA is None: # image is corrupted
             return
-        if self._lut is None:
-            # Greyscale image
-            for c in range(3):
-                self._BGRA[:,:,c] = self._array_scaled
-        else:
-            # Create RGB array by indexing LUT with pixel array 
-            for c in range(3):
-                self._BGRA[:,:,c] = self._lut[self._array_scaled, 2-c]
+        # Create BGRA array by indexing the LUT with the windowed array
+        self._renderer.render()
         self.update()
 
     def array(self):
@@ -255,11 +243,12 @@ class MaskItem(AnyItem):
 
     def __init__(self, imageItem, mask, opacity=0.75, color=0): 
         super().__init__(imageItem)
-        self._bin = []
-        self._current = None
+        self._bin = None
+        self._history = MaskHistory()
         self._BGRA = None
         self._qImage = None
         self._BGR = list(reversed(self.RGB(color)))
+        self._dirty = None # (x0, y0, x1, y1) changed since last display - None for all
         self.boundingRectangle = None
         self.setData(mask)
         self.setOpacity(opacity)
@@ -278,48 +267,86 @@ class MaskItem(AnyItem):
         if self._qImage is not None:
             painter.drawImage(0, 0, self._qImage)
 
-    def setBin(self, bin):
-        self._bin[self._current] = bin
+    def setBin(self, bin, rect=None):
+        """Replace the current mask.
 
-    def bin(self):
-        if self._current == None:
+        rect is the region (x0, y0, x1, y1) where bin differs from the 
+        current mask. If it is not provided it is derived from the 
+        difference.
+        """
+        if self._bin is None or self._bin.shape != bin.shape:
+            self._bin = bin
+            self._setOverlay()
             return
-        return self._bin[self._current]
+        if rect is None:
+            rect = bounding_box(self._bin != bin)
+            if rect is None:
+                rect = (0, 0, 0, 0)
+        self._bin = bin
+        self.setDirty(rect)
+
+    def setDirty(self, rect=None):
+        """Mark a region (x0, y0, x1, y1) of the mask as changed.
+
+        If rect is None, all of the mask is marked as changed.
+        """
+        if rect is None:
+            self._dirty = None
+        elif self._dirty is None:
+            # All of the mask is rendered anyway
+            return
+        elif self._dirty[2] <= self._dirty[0] or self._dirty[3] <= self._dirty[1]:
+            self._dirty = rect
+        elif rect[2] > rect[0] and rect[3] > rect[1]:
+            self._dirty = (
+                min(self._dirty[0], rect[0]), min(self._dirty[1], rect[1]), 
+                max(self._dirty[2], rect[2]), max(self._dirty[3], rect[3]),
+            )
+
+    def bin(self):
+        return self._bin
 
     def setData(self, mask):
         #array = mask.array()
         #self._bin = array != 0
         if mask is None:
             return
-        self._bin = [mask != 0]
-        self._current = 0
-        shape = (self.bin().shape[1], self.bin().shape[0], 4)
-        self._BGRA = np.zeros(shape, dtype=np.ubyte)
-        self._qImage = QImage(self._BGRA, self._BGRA.shape[1], self._BGRA.shape[0], QImage.Format_ARGB32)
+        self._bin = mask != 0
+        self._setOverlay()
         self.setDisplay()
         self.maskChanged.emit()
 
     def initMask(self):
         rect = self.boundingRect()
         dx, dy = rect.width(), rect.height()
-        self._bin = [np.zeros((int(dx), int(dy)), dtype=bool)]
-        self._current = 0
+        self._bin = np.zeros((int(dx), int(dy)), dtype=bool)
+        self._setOverlay()
+
+    def _setOverlay(self):
+        # Allocate an empty overlay for a new mask
+        self._history.clear()
+        self._dirty = None
         shape = (self.bin().shape[1], self.bin().shape[0], 4)
         self._BGRA = np.zeros(shape, dtype=np.ubyte)
         self._qImage = QImage(self._BGRA, self._BGRA.shape[1], self._BGRA.shape[0], QImage.Format_ARGB32)
 
     def setDisplay(self):
-        if self._bin == []:
+        """Render the changed region of the mask, or all of it if unknown"""
+        if self._bin is None:
             return
-        LUT = np.array([0,1], dtype=np.ubyte)
-        mask = self.bin().astype(np.ubyte)
-        mask = np.transpose(mask)
-        mask = LUT[mask]
-        for c in range(3):
-            if self._BGR[c] != 0:
-                self._BGRA[:,:,c] = mask*self._BGR[c]
-        self._BGRA[:,:,3] = mask*255
-        self.update()
+        bin = self.bin()
+        if self._dirty is None:
+            x0, y0, x1, y1 = 0, 0, bin.shape[0], bin.shape[1]
+        else:
+            x0, y0, x1, y1 = self._dirty
+        self._dirty = (0, 0, 0, 0)
+        if x1 > x0 and y1 > y0:
+            mask = np.transpose(bin[x0:x1, y0:y1]).view(np.ubyte)
+            BGRA = self._BGRA[y0:y1, x0:x1, :]
+            for c in range(3):
+                np.multiply(mask, self._BGR[c], out=BGRA[:,:,c])
+            np.multiply(mask, 255, out=BGRA[:,:,3])
+            self.update(QRectF(x0, y0, x1-x0, y1-y0))
         self.maskChanged.emit()
 
     def setPixel(self, x, y, value):
@@ -332,32 +359,69 @@ class MaskItem(AnyItem):
         else:
             self._BGRA[y,x,:] = 0
 
+    def setPixels(self, x, y, footprint, value):
+        """Set all pixels in a boolean footprint with lower corner (x,y)"""
+        bin = self.bin()
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + footprint.shape[0], bin.shape[0])
+        y1 = min(y + footprint.shape[1], bin.shape[1])
+        if x0 >= x1 or y0 >= y1:
+            return
+        footprint = footprint[x0-x:x1-x, y0-y:y1-y]
+        bin[x0:x1, y0:y1][footprint] = value
+        BGRA = self._BGRA[y0:y1, x0:x1, :]
+        if value:
+            BGRA[footprint.T] = self._BGR + [255]
+        else:
+            BGRA[footprint.T] = 0
+        self.update(QRectF(x0, y0, x1-x0, y1-y0))
+
+    def setPixelList(self, x, y, value):
+        """Set the pixels with coordinates in arrays x and y"""
+        if x.size == 0:
+            return
+        self.bin()[x,y] = value
+        if value: 
+            self._BGRA[y,x,:3] = self._BGR
+            self._BGRA[y,x,3] = 255
+        else:
+            self._BGRA[y,x,:] = 0
+        x0, y0 = np.amin(x), np.amin(y)
+        self.update(QRectF(x0, y0, np.amax(x)-x0+1, np.amax(y)-y0+1))
+
     def extend(self):
-        if self._bin == []:
+        """Start a new edit that can be undone"""
+        if self._bin is None:
             self.initMask()
-        bin = copy.deepcopy(self.bin())
-        self._bin = self._bin[:self._current+1]
-        self._bin.append(bin)
-        self._current += 1
+        self._history.begin(self._bin)
         self.maskChanged.emit()
 
+    def canUndo(self):
+        return self._history.canUndo()
+
+    def canRedo(self):
+        return self._history.canRedo()
+
     def undo(self):
-        if self._current == None:
+        if self._bin is None:
             return
-        if self._current != 0:
-            self._current -= 1
+        rect = self._history.undo(self._bin)
+        if rect is not None:
+            self.setDirty(rect)
             self.setDisplay()
     
     def redo(self):
-        if self._current == None:
+        if self._bin is None:
             return
-        if self._current != len(self._bin)-1:
-            self._current += 1
+        rect = self._history.redo(self._bin)
+        if rect is not None:
+            self.setDirty(rect)
             self.setDisplay()
          
     def erase(self):
         self.extend()
         self.bin().fill(False)
+        self.setDirty()
         self.setDisplay()
 
     def RGB(self, color):
@@ -0,0 +1,98 @@
+import numpy as np
+
+from wezel.canvas.utils import bounding_box
+
+
+class MaskHistory():
+    """Undo and redo history of a boolean mask.
+
+    Each edit is stored as the bounding box of the pixels that changed,
+    and the bit-packed XOR difference inside that box. Applying the
+    difference a second time reverts it, so the same record serves
+    for undo and redo. When the history uses more than maxBytes,
+    the oldest edits are forgotten.
+    """
+
+    def __init__(self, maxBytes=64*2**20):
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self._undo = []
+        self._redo = []
+        self._base = None   # copy of the mask before the current edit
+
+    def clear(self):
+        self.nbytes = 0
+        self._undo = []
+        self._redo = []
+        self._base = None
+
+    def canUndo(self):
+        return self._base is not None or self._undo != []
+
+    def canRedo(self):
+        return self._redo != []
+
+    def begin(self, mask):
+        """Start a new edit of the mask"""
+        self.commit(mask)
+        for edit in self._redo:
+            self.nbytes -= self._size(edit)
+        self._redo = []
+        self._base = mask.copy()
+
+    def commit(self, mask):
+        """Close the current edit and add it to the history"""
+        if self._base is None:
+            return
+        rect = bounding_box(self._base != mask)
+        if rect is None:
+            edit = (None, None)
+        else:
+            x0, y0, x1, y1 = rect
+            diff = self._base[x0:x1, y0:y1] != mask[x0:x1, y0:y1]
+            edit = (rect, np.packbits(diff))
+        self._base = None
+        self._undo.append(edit)
+        self.nbytes += self._size(edit)
+        while self.nbytes > self.maxBytes and len(self._undo) > 1:
+            self.nbytes -= self._size(self._undo.pop(0))
+
+    def undo(self, mask):
+        """Revert the last edit in place.
+
+        Returns the changed region (x0, y0, x1, y1), or None if there
+        is nothing to undo.
+        """
+        self.commit(mask)
+        if self._undo == []:
+            return
+        edit = self._undo.pop()
+        self._redo.append(edit)
+        return self._apply(mask, edit)
+
+    def redo(self, mask):
+        """Reapply the last edit that was undone, in place.
+
+        Returns the changed region (x0, y0, x1, y1), or None if there
+        is nothing to redo.
+        """
+        if self._redo == []:
+            return
+        edit = self._redo.pop()
+        self._undo.append(edit)
+        return self._apply(mask, edit)
+
+    def _apply(self, mask, edit):
+        rect, bits = edit
+        if rect is None:
+            return (0, 0, 0, 0)
+        x0, y0, x1, y1 = rect
+        shape = (x1-x0, y1-y0)
+        diff = np.unpackbits(bits, count=shape[0]*shape[1]).reshape(shape)
+        mask[x0:x1, y0:y1] ^= diff.view(bool)
+        return rect
+
+    def _size(self, edit):
+        if edit[1] is None:
+            return 0
+        return edit[1].nbytes
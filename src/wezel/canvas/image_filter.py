@@ -19,8 +19,6 @@ class ImageWindow(canvas.FilterItem):
         self.icon = QIcon(pixMap)
         self.toolTip = 'Select color scale window..'
         self.text = 'Window' 
-        self._min = None
-        self._max = None
         self.setActionPick()
 
     def window(self, dx, dy):
@@ -28,21 +26,19 @@ class ImageWindow(canvas.FilterItem):
 
         cnvs = self.scene().parent()
         item = cnvs.imageItem
-        if self._min is None:
-            self._min = np.amin(item._array)
-            self._max = np.amax(item._array)
+        min, max = item.stats.min(), item.stats.max()
        
         # Move 1024 to change the center over the full range
         # Speed is faster further away from the center of the range
         center = item._center 
-        v0 = (self._max-self._min)/1024
+        v0 = (max-min)/1024
         a0 = 1.0/256
-        vy = v0 + a0*abs((center - (self._min+(self._max-self._min)/2.0)))
+        vy = v0 + a0*abs((center - (min+(max-min)/2.0)))
         center = center + vy * dy
 
         # Changing the width is faster at larger widths
         width = item._width
-        v0 = (self._max-self._min)/512
+        v0 = (max-min)/512
         a0 = 1.0/64
         vx = v0 + a0*width
         width = width - vx * dx
@@ -14,9 +14,10 @@ from wezel import canvas, icons
 class MaskBrush(canvas.FilterItem):
     """Painting or erasing tool.
     """
-    def __init__(self, brushSize=3, mode="paint"):
+    def __init__(self, brushSize=3, mode="paint", brushShape="square"):
         super().__init__()
         self.brushSize = brushSize
+        self.brushShape = brushShape
         self.setMode(mode)
         self.setActionPick()
 
@@ -43,11 +44,18 @@ class MaskBrush(canvas.FilterItem):
         pen.setWidth(0)
         painter.setPen(pen)
         w = int((self.brushSize - 1)/2)
-        painter.drawRect(
-            self.x-w, 
-            self.y-w, 
-            self.brushSize, 
-            self.brushSize)
+        if self.brushShape == 'circle':
+            painter.drawEllipse(
+                self.x-w, 
+                self.y-w, 
+                self.brushSize, 
+                self.brushSize)
+        else:
+            painter.drawRect(
+                self.x-w, 
+                self.y-w, 
+                self.brushSize, 
+                self.brushSize)
 
     def hoverMoveEvent(self, event):
         self.x = int(event.pos().x())
@@ -71,30 +79,43 @@ class MaskBrush(canvas.FilterItem):
         self.update()
 
     def mouseMoveEvent(self, event):
+        x, y = self.x, self.y
         self.x = int(event.pos().x())
         self.y = int(event.pos().y())
         buttons = event.buttons()
         if buttons == Qt.LeftButton:
-            self.paintPixels() 
+            self.paintPixels(x, y) 
         cnvs = self.scene().parent() 
         cnvs.mousePositionMoved.emit(self.x, self.y)
  
-    def paintPixels(self):
+    def paintPixels(self, x=None, y=None):
+        """Paint the brush along the line from (x,y) to the current position"""
         cnvs = self.scene().parent() 
         item = cnvs.maskItem
-        w = int((self.brushSize - 1)/2)
-        for x in range(self.x-w, self.x+w+1, 1):
-            if 0 <= x < item.bin().shape[0]:
-                for y in range(self.y-w, self.y+w+1, 1):
-                    if 0 <= y < item.bin().shape[1]:
-                        item.setPixel(x, y, self.mode=="paint")
-        item.update()
+        if x is None:
+            x, y = self.x, self.y
+        stencil = canvas.brush_stencil(self.brushSize, self.brushShape)
+        x, y, footprint = canvas.brush_stroke(x, y, self.x, self.y, stencil)
+        item.setPixels(x, y, footprint, self.mode=="paint")
+
+    def brushPixels(self):
+        """Coordinates of the pixels under the brush"""
+        item = self.scene().parent().maskItem
+        stencil = canvas.brush_stencil(self.brushSize, self.brushShape)
+        x, y, footprint = canvas.brush_stroke(self.x, self.y, self.x, self.y, stencil)
+        i, j = np.nonzero(footprint)
+        i, j = i+x, j+y
+        inside = (0 <= i) & (i < item.bin().shape[0]) & (0 <= j) & (j < item.bin().shape[1])
+        return i[inside], j[inside]
 
     def contextMenu(self):
         return self.actionPick.menu()
        
-    def setOptions(self, brushSize):
-        self.brushSize = brushSize
+    def setOptions(self, option):
+        if 'size' in option:
+            self.brushSize = option['size']
+        if 'shape' in option:
+            self.brushShape = option['shape']
         self.pick()
 
     def menuOptions(self):
@@ -113,11 +134,26 @@ class MaskBrush(canvas.FilterItem):
         }
         for text, value in settings.items():
             action = QAction(text)
-            action.option = value
+            action.option = {'size': value}
             action.setCheckable(True)
             action.setChecked(value == self.brushSize)
             actionGroup.addAction(action)
             menu.addAction(action)
+
+        self.addSeparator(menu)
+
+        actionGroup = QActionGroup(menu)
+        settings = {
+            'Square': 'square',
+            'Circle': 'circle',
+        }
+        for text, value in settings.items():
+            action = QAction(text)
+            action.option = {'shape': value}
+            action.setCheckable(True)
+            action.setChecked(value == self.brushShape)
+            actionGroup.addAction(action)
+            menu.addAction(action)
         return menu
 
 
@@ -677,9 +713,11 @@ class MaskThreshold(canvas.FilterItem):
         item = self.scene().parent().imageItem
         self.center, self.width = item._center, item._width
         self.array = item._array
-        self.min = np.amin(self.array)
-        self.max = np.amax(self.array)
+        self.stats = item.stats
+        self.min = item.stats.min()
+        self.max = item.stats.max()
         self.range = self.max-self.min
+        self.selected = None # range of sorted pixels in the mask
         #self.setData()
 
     def mousePressEvent(self, event):
@@ -688,6 +726,7 @@ class MaskThreshold(canvas.FilterItem):
         if event.button() == Qt.LeftButton:
             item = self.scene().parent().maskItem
             item.extend()
+            self.selected = None
 
     def mouseMoveEvent(self, event):
         self.x = int(event.pos().x())
@@ -700,6 +739,10 @@ class MaskThreshold(canvas.FilterItem):
     def mouseReleaseEvent(self, event):
         self.x = int(event.pos().x())
         self.y = int(event.pos().y())
+        if event.button() == Qt.LeftButton and self.selected is not None:
+            # Changes during the drag are reported once at the end
+            item = self.scene().parent().maskItem
+            item.maskChanged.emit()
         self.update()
 
     def window(self, dx, dy):
@@ -722,12 +765,30 @@ class MaskThreshold(canvas.FilterItem):
         width = width + vx * dx
         self.width = width if width>1 else 1
 
-        # Update display
+        # Find the pixels in the window
         min, max = self.center-self.width/2, self.center+self.width/2
-        threshold = np.logical_and(min<=self.array, self.array<=max)
+        order, sorted = self.stats.sorted()
+        i0 = np.searchsorted(sorted, min, side='left')
+        i1 = np.searchsorted(sorted, max, side='right')
+
+        # Update display
         item = self.scene().parent().maskItem
-        item.setBin(threshold)
-        item.setDisplay()
+        if self.selected is None:
+            threshold = np.zeros(self.array.shape, dtype=bool)
+            threshold.flat[order[i0:i1]] = True
+            item.setBin(threshold)
+            item.setDisplay()
+        else:
+            # Only change the pixels that crossed the bounds
+            j0, j1 = self.selected
+            ny = self.array.shape[1]
+            for a, b in [(j0, np.minimum(j1, i0)), (np.maximum(j0, i1), j1)]:
+                x, y = np.divmod(order[a:b], ny)
+                item.setPixelList(x, y, False)
+            for a, b in [(i0, np.minimum(i1, j0)), (np.maximum(i0, j1), i1)]:
+                x, y = np.divmod(order[a:b], ny)
+                item.setPixelList(x, y, True)
+        self.selected = (i0, i1)
 
 
 class MaskPaintByNumbers(MaskBrush):
@@ -752,26 +813,13 @@ class MaskPaintByNumbers(MaskBrush):
     #     item = self.scene().parent().imageItem
     #     self.array = item._array
 
-    def paintPixels(self):
+    def paintPixels(self, x=None, y=None):
         item = self.scene().parent().maskItem
         array = self.scene().parent().imageItem._array
-        min = max = None 
-        w = int((self.brushSize - 1)/2)
-        for x in range(self.x-w, self.x+w+1, 1):
-            if 0 <= x < item.bin().shape[0]:
-                for y in range(self.y-w, self.y+w+1, 1):
-                    if 0 <= y < item.bin().shape[1]:
-                        #v = self.array[x,y]
-                        v = array[x,y]
-                        if min is None:
-                            min = max = v
-                        else:
-                            if v < min:
-                                min = v
-                            if v > max:
-                                max = v
-        if min is None or max is None:
+        x, y = self.brushPixels()
+        if x.size == 0:
             return
+        min, max = np.amin(array[x,y]), np.amax(array[x,y])
         if self.mode == 'paint':
             #inrange = np.logical_and(min <= self.array, self.array <= max)
             inrange = np.logical_and(min <= array, array <= max)
@@ -785,8 +833,9 @@ class MaskPaintByNumbers(MaskBrush):
 
 class MaskRegionGrowing(MaskBrush):
 
-    def __init__(self, tolerance=5.0, mode='paint'):
+    def __init__(self, tolerance=5.0, mode='paint', connectivity=4):
         self.tolerance = tolerance
+        self.connectivity = connectivity
         super().__init__(mode=mode)
 
     def setMode(self, mode):
@@ -809,31 +858,17 @@ class MaskRegionGrowing(MaskBrush):
     #     item = self.scene().parent().imageItem
     #     self.array = item._array
 
-    def paintPixels(self):
+    def paintPixels(self, x=None, y=None):
         # Get range of values under brush
         item = self.scene().parent().maskItem
         array = self.scene().parent().imageItem._array
         # Build a seed list of all pixels under the brush
         # and find minimum and maximum value over the seeds
-        seed = []
-        min = max = None 
-        w = int((self.brushSize - 1)/2)
-        for x in range(self.x-w, self.x+w+1, 1):
-            if 0 <= x < item.bin().shape[0]:
-                for y in range(self.y-w, self.y+w+1, 1):
-                    if 0 <= y < item.bin().shape[1]:
-                        seed.append([x,y])
-                        #v = self.array[x,y]
-                        v = array[x,y]
-                        if min is None:
-                            min = max = v
-                        else:
-                            if v < min:
-                                min = v
-                            elif v > max:
-                                max = v
-        if min is None or max is None:
+        x, y = self.brushPixels()
+        if x.size == 0:
             return
+        seed = np.column_stack((x, y)).tolist()
+        min, max = np.amin(array[x,y]), np.amax(array[x,y])
         # Find the range of values with the given tolerance
         center = (max+min)/2
         width = self.tolerance*(max-min)/2
@@ -841,15 +876,18 @@ class MaskRegionGrowing(MaskBrush):
         # Grow region to include all pixels in the same range
         if self.mode == 'paint':
             #canvas.utils.region_grow_add(self.array, item.bin(), seed, min, max)
-            canvas.utils.region_grow_add(array, item.bin(), seed, min, max)
+            canvas.utils.region_grow_add(array, item.bin(), seed, min, max, self.connectivity)
         else:
             #canvas.utils.region_grow_remove(self.array, item.bin(), seed, min, max)
-            canvas.utils.region_grow_remove(array, item.bin(), seed, min, max)
+            canvas.utils.region_grow_remove(array, item.bin(), seed, min, max, self.connectivity)
+        item.setDirty()
         item.setDisplay()
 
     def setOptions(self, option):
         if 'tolerance' in option:
             self.tolerance = option['tolerance']
+        if 'connectivity' in option:
+            self.connectivity = option['connectivity']
         if 'size' in option:
             self.brushSize = option['size']
         self.pick()
@@ -900,6 +938,21 @@ class MaskRegionGrowing(MaskBrush):
             actionGroup.addAction(action)
             menu.addAction(action)
 
+        self.addSeparator(menu)
+
+        actionGroup = QActionGroup(menu)
+        options = {
+            'Connectivity: 4 neighbours': 4,
+            'Connectivity: 8 neighbours': 8,
+        }
+        for text, value in options.items():
+            action = QAction(text)
+            action.option = {'connectivity': value}
+            action.setCheckable(True)
+            action.setChecked(value == self.connectivity)
+            actionGroup.addAction(action)
+            menu.addAction(action)
+
         return menu
 
 
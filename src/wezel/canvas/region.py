@@ -0,0 +1,60 @@
+import numpy as np
+
+from wezel.canvas.utils import bounding_box
+
+
+class Region():
+    """Masks of a region of interest on the images of a series.
+
+    Masks are stored per SOPInstanceUID, cropped to the bounding box
+    of their pixels and bit-packed, so that a region drawn on a few
+    slices takes little memory. A full-size boolean mask is rebuilt
+    when mask() is called.
+    """
+
+    def __init__(self, name, color):
+        self.name = name
+        self.color = color
+        self.nbytes = 0
+        self._masks = {}    # uid: (shape, rect, bits)
+
+    def __contains__(self, uid):
+        return uid in self._masks
+
+    def __len__(self):
+        return len(self._masks)
+
+    def uids(self):
+        return list(self._masks.keys())
+
+    def mask(self, uid):
+        """Boolean mask of an image, or None if the image has no mask"""
+        if uid not in self._masks:
+            return
+        shape, rect, bits = self._masks[uid]
+        mask = np.zeros(shape, dtype=bool)
+        if rect is not None:
+            x0, y0, x1, y1 = rect
+            crop = (x1-x0, y1-y0)
+            crop = np.unpackbits(bits, count=crop[0]*crop[1]).reshape(crop)
+            mask[x0:x1, y0:y1] = crop.view(bool)
+        return mask
+
+    def setMask(self, uid, mask):
+        self.removeMask(uid)
+        mask = mask != 0
+        rect = bounding_box(mask)
+        if rect is None:
+            bits = None
+        else:
+            x0, y0, x1, y1 = rect
+            bits = np.packbits(mask[x0:x1, y0:y1])
+            self.nbytes += bits.nbytes
+        self._masks[uid] = (mask.shape, rect, bits)
+
+    def removeMask(self, uid):
+        if uid not in self._masks:
+            return
+        bits = self._masks.pop(uid)[2]
+        if bits is not None:
+            self.nbytes -= bits.nbytes
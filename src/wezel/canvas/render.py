@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class ImageRenderer():
+    """Renders a 2D pixel array into a BGRA buffer for display.
+
+    The window and the colour lookup table are applied with a single
+    fused 256-entry BGRA table. All buffers are allocated once when
+    the array is set, and reused whenever the window or the colormap
+    changes, so that interactive windowing does not allocate memory.
+
+    Arrays with integer values and a range of at most 65536 values
+    are rendered in the integer domain: a window change only rebuilds
+    a table indexed by the raw pixel value (offset by the minimum),
+    and the image is coloured with a single lookup in that table.
+    """
+
+    def __init__(self, array=None):
+        self.BGRA = None
+        self._BGRA32 = None
+        self._pixels = None     # float32 pixel values, transposed (or table values)
+        self._scratch = None    # float32 scratch buffer
+        self._index = None      # ubyte index into the fused LUT
+        self._offset = None     # minimum pixel value in the integer domain
+        self._raw = None        # uint16 pixel values minus offset
+        self._levels = None     # ubyte index into the fused LUT per table entry
+        self._table32 = None    # BGRA colour per table entry
+        self._lut32 = np.empty(256, dtype=np.uint32)
+        self.setLUT(None)
+        if array is not None:
+            self.setArray(array)
+
+    def setArray(self, array, min=None, max=None):
+        """Allocate the display buffers for a new pixel array.
+
+        The minimum and maximum of the array are computed if they 
+        are not provided.
+        """
+        nx, ny = array.shape[0], array.shape[1]
+        # QImage expects the array transposed
+        self._pixels = np.ascontiguousarray(np.transpose(array), dtype=np.float32)
+        self._scratch = np.empty((ny, nx), dtype=np.float32)
+        self._index = np.empty((ny, nx), dtype=np.ubyte)
+        self.BGRA = np.zeros((ny, nx, 4), dtype=np.ubyte)
+        self._BGRA32 = self.BGRA.view(np.uint32).reshape((ny, nx))
+        self._setIntegerDomain(min, max)
+
+    def _setIntegerDomain(self, min=None, max=None):
+        self._offset = None
+        if self._pixels.size == 0:
+            return
+        # The minimum and maximum commute with the conversion to float32
+        min = np.amin(self._pixels) if min is None else np.float32(min)
+        max = np.amax(self._pixels) if max is None else np.float32(max)
+        if not max-min < 65536:
+            return
+        # Pixel values are often integers stored as floats.
+        np.rint(self._pixels, out=self._scratch)
+        if not np.array_equal(self._scratch, self._pixels):
+            return
+        n = int(max-min) + 1
+        self._offset = min
+        self._raw = np.empty(self._pixels.shape, dtype=np.uint16)
+        np.subtract(self._pixels, min, out=self._scratch)
+        np.copyto(self._raw, self._scratch, casting='unsafe')
+        self._levels = np.empty(n, dtype=np.ubyte)
+        self._table32 = np.empty(n, dtype=np.uint32)
+        # From here on the window is applied to the table entries
+        # rather than to the pixels.
+        self._pixels = np.arange(n, dtype=np.float32) + min
+        self._scratch = np.empty(n, dtype=np.float32)
+        self._index = self._levels
+
+    def setLUT(self, lut):
+        """Build the fused BGRA table from an RGB lookup table.
+
+        lut is a (256, 3) array with values in the range [0, 255],
+        or None for greyscale.
+        """
+        BGRA = self._lut32.view(np.ubyte).reshape((256, 4))
+        if lut is None:
+            grey = np.arange(256, dtype=np.ubyte)
+            for c in range(3):
+                BGRA[:,c] = grey
+        else:
+            for c in range(3):
+                BGRA[:,c] = lut[:,2-c]
+        BGRA[:,3] = 255
+
+    def setWindow(self, center, width):
+        """Scale the pixel values in the window to the index range [0, 255]"""
+        if self._pixels is None:
+            return
+        min = center - width/2
+        max = center + width/2
+        scale = 255/(max-min) if max > min else 0
+        np.subtract(self._pixels, min, out=self._scratch)
+        np.multiply(self._scratch, scale, out=self._scratch)
+        np.clip(self._scratch, 0, 255, out=self._scratch)
+        np.copyto(self._index, self._scratch, casting='unsafe')
+
+    def render(self):
+        """Write the colours into the BGRA buffer"""
+        if self.BGRA is None:
+            return
+        if self._offset is None:
+            np.take(self._lut32, self._index, out=self._BGRA32)
+        else:
+            np.take(self._lut32, self._levels, out=self._table32)
+            np.take(self._table32, self._raw, out=self._BGRA32)
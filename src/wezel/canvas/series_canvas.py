@@ -1,17 +1,24 @@
 import timeit
 import random
 import numpy as np
+import pydicom
+from PyQt5.QtCore import QObject, QThreadPool, pyqtSignal
 
-from dbdicom.wrappers import scipy
+from dbdicom.utils.image import (
+    multislice_affine_transform, affine_matrix, affine_matrix_multislice,
+)
+from dbdicom.ds.create import read_dataset
 
-from wezel import widgets, canvas
+from wezel import widgets, canvas, headers, jobs
 from wezel.canvas.utils import colormap_to_LUT
+from wezel.widgets.log_to_GUI import Worker
 
 class SeriesCanvas(canvas.Canvas):
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self._model = SeriesCanvasModel()
+        self._model.regionLoaded.connect(self.regionLoaded)
 
     def slotMaskChanged(self):
         if self._model._regions == []:
@@ -20,7 +27,8 @@ class SeriesCanvas(canvas.Canvas):
             self._model.setColor(clr)
             if self.toolBar is not None:
                 self.toolBar.newRegion()
-        self.saveMask()
+        # The mask is stored in the region when the image, the region 
+        # or the display changes, not on every edit.
         if self.toolBar is not None:
             self.toolBar.maskChanged()
 
@@ -109,11 +117,17 @@ class SeriesCanvas(canvas.Canvas):
         #self.newRegion.emit()
 
     def setCurrentRegionName(self, name):
-        self._model._currentRegion['name'] = name
+        self._model._currentRegion.name = name
 
     def loadRegion(self):
         self._model.loadRegion()
+
+    def regionLoaded(self, region):
+        self.saveMask()
+        self._model._currentRegion = region
         self.setMask(self._model.mask(), color=self._model.color())
+        if self.toolBar is not None:
+            self.toolBar.newRegion()
 
     def setColormap(self, cmap=None):
         super().setColormap(cmap)
@@ -133,15 +147,25 @@ class SeriesCanvas(canvas.Canvas):
 
 
 
-class SeriesCanvasModel:
+class SeriesCanvasModel(QObject):
+    """Display settings and regions of the images in a series.
+
+    Regions are loaded from other series in the background, and 
+    regionLoaded is emitted when a region is ready.
+    """
+    regionLoaded = pyqtSignal(object)
+
     def __init__(self):
+        super().__init__()
+        self.threadPool = QThreadPool()
+        self.threadPool.setMaxThreadCount(1)
         self._series = None
         self._center = {}
         self._width = {}
         self._lut = {}
         self._cmap = {}
         self._regions = []
-        self._currentRegion = None # dict
+        self._currentRegion = None # canvas.Region
         self._currentImage = None # uid
 
     def center(self):
@@ -172,31 +196,30 @@ class SeriesCanvasModel:
     def color(self):
         if self._currentRegion is None:
             return 0
-        return self._currentRegion['color']
+        return self._currentRegion.color
 
     def mask(self):
         if self._currentRegion is None:
             return
-        if self._currentImage in self._currentRegion:
-            return self._currentRegion[self._currentImage]
+        return self._currentRegion.mask(self._currentImage)
 
     def setMask(self, bin):
         if bin is None:
             return
         if self._currentRegion is None:
             return
-        self._currentRegion[self._currentImage] = bin
+        self._currentRegion.setMask(self._currentImage, bin)
         
     def setColor(self, RGB):
         if self._currentRegion is None:
             return
-        self._currentRegion['color'] = RGB
+        self._currentRegion.color = RGB
 
     def regionNames(self):
-        return [r['name'] for r in self._regions]
+        return [r.name for r in self._regions]
 
     def regionColors(self):
-        return [r['color'] for r in self._regions]
+        return [r.color for r in self._regions]
 
     def addRegion(self):
         # Find unique name
@@ -207,7 +230,7 @@ class SeriesCanvasModel:
             count += 1 
             newName = 'New Region [' + str(count).zfill(3) + ']'
         # Add new region
-        newRegion = {'name': newName, 'color': self.newColor()}
+        newRegion = canvas.Region(newName, self.newColor())
         self._regions.append(newRegion)
         self._currentRegion = newRegion
 
@@ -248,27 +271,39 @@ class SeriesCanvasModel:
 
 
     def saveRegions(self):
-        #start = timeit.default_timer()
+        start = timeit.default_timer()
         databaseUpdated = False
         series = self._series
         if not series.exists():
             return databaseUpdated
-        images = series.instances()
+        manager = series.manager
+        images = {image.uid: image for image in series.instances()}
+        nslices = 0
         for region in self._regions:
-            if len(region.keys()) > 2:
-                databaseUpdated = True
-                roi_series = series.new_sibling(SeriesDescription=region['name'])
-                for cnt, image in enumerate(images):
-                    series.status.progress(cnt+1, len(images), 'Saving region '+ region['name'])
-                    uid = image.SOPInstanceUID
-                    if uid in region:
-                        array = region[uid].astype(np.float32)
-                        mask = image.copy_to(roi_series)
-                        mask.set_array(array)
-                        mask.WindowCenter = 0.5
-                        mask.WindowWidth = 1.0
+            masked = [uid for uid in images if uid in region]
+            if masked == []:
+                continue
+            # adopt() returns the copies in the order of the register
+            masked = manager.register.loc[manager.keys(masked), 'SOPInstanceUID'].tolist()
+            masked = [images[uid] for uid in masked]
+            databaseUpdated = True
+            roi_series = series.new_sibling(SeriesDescription=region.name)
+            # Copy all headers in one operation, then write each mask once
+            copies = roi_series.adopt(masked)
+            if not isinstance(copies, list):
+                copies = [copies]
+            for cnt, mask in enumerate(copies):
+                series.status.progress(cnt+1, len(copies), 'Saving region '+ region.name)
+                ds = mask.get_dataset()
+                set_mask_array(ds, region.mask(masked[cnt].uid))
+                mask.set_dataset(ds)
+                mask.clear()
+            nslices += len(copies)
         series.status.hide()
-        #print(timeit.default_timer()-start)
+        if databaseUpdated:
+            time = timeit.default_timer()-start
+            series.status.message('Saved ' + str(nslices) + ' region slices in ' 
+                + str(round(time, 1)) + ' sec (' + str(round(nslices/time)) + ' slices/sec)')
         return databaseUpdated
 
 
@@ -285,21 +320,186 @@ class SeriesCanvasModel:
         seriesList = [seriesList[i] for i in input.values[0]["value"]]
         seriesLabels = [seriesLabels[i] for i in input.values[0]["value"]]
         suffix = ' mapped to ' + self._series.instance().SeriesDescription
+        # The database is not thread-safe. Only the files of the images 
+        # are listed here - headers and pixels are read in the background,
+        # after the running job if any.
+        target = series_sources(self._series)
         # Overlay each of the selected series on the displayed series
         for s, series in enumerate(seriesList):
-            # Create overlay
-            #region, images = series.map_mask_to(self._series)
-            region, images = scipy.map_mask_to(series, self._series)
-            # Add new region
-            newRegion = {'name': seriesLabels[s] + suffix, 'color': self.newColor()}
-            if isinstance(region, list): # If self._series has multiple slice groups
-                for r, reg in enumerate(region):
-                    for i, image in np.ndenumerate(images[r]):
-                        if image is not None:
-                            newRegion[image.SOPInstanceUID] = reg[:,:,i[0]] != 0
+            name = seriesLabels[s] + suffix
+            worker = Worker(_map_series, series_sources(series), target)
+            worker.signals.progress.connect(lambda percent, name=name: 
+                self._series.status.progress(percent, 100, 'Loading region ' + name))
+            worker.signals.result.connect(lambda result, name=name: 
+                self._addRegion(name, *result))
+            worker.signals.finished.connect(lambda: self._series.status.hide())
+            self.threadPool.start(worker)
+
+    def _addRegion(self, name, target, masks):
+        newRegion = canvas.Region(name, self.newColor())
+        for (_, uids, _, z, _, _), mask in zip(target, masks):
+            for i, uid in enumerate(uids):
+                newRegion.setMask(uid, mask[:,:,z[i]])
+        self._regions.append(newRegion)
+        self.regionLoaded.emit(newRegion)
+
+
+def series_sources(series):
+    """Where the images of a series can be read without the database.
+
+    Returns a list with the file of each image, or its dataset if 
+    the image has changes in memory. Only the register is read.
+    """
+    manager = series.manager
+    sources = []
+    for key in series.keys():
+        if (key in manager.dataset) or (manager.path is None):
+            sources.append(manager.get_instance_dataset(key))
+        else:
+            sources.append(manager.filepath(key))
+    return sources
+
+
+def read_source(source):
+    """Dataset of an image returned by series_sources()"""
+    if isinstance(source, str):
+        return read_dataset(source)
+    return source
+
+
+def slice_groups(sources):
+    """Geometry of the slice groups of the images in a list of sources.
+
+    sources is a list as returned by series_sources(). Returns a list
+    with, for each slice group, the affine matrix, the SOPInstanceUIDs 
+    and the sources of the images, the slice index of each image, the 
+    shape of the volume and the slice thickness. Only the headers are 
+    read. The affine matrix is computed as in dbdicom.
+    """
+    tags = [
+        'SOPInstanceUID', 'ImageOrientationPatient', 'ImagePositionPatient', 
+        'PixelSpacing', 'SliceThickness', 'Rows', 'Columns',
+    ]
+    files = [source for source in sources if isinstance(source, str)]
+    values = headers.read_files(files, tags)
+    groups = {}
+    for source in sources:
+        if isinstance(source, str):
+            row = values.loc[source].tolist()
+        else:
+            row = source.get_values(tags)
+        if row[0] is None:
+            continue
+        groups.setdefault(tuple(row[1]), []).append((source, row))
+    result = []
+    for orientation, images in groups.items():
+        first = images[0][1]
+        normal = np.cross(orientation[:3], orientation[3:])
+        # Slices are ordered by their position along the normal, as in the affine
+        position = [list(row[2]) for _, row in images]
+        locations, z = np.unique(np.dot(position, normal), return_inverse=True)
+        if locations.size == 1:
+            affine = affine_matrix(orientation, first[2], first[3], first[4])
+        else:
+            position = [x for i, x in enumerate(position) if i == position.index(x)]
+            affine = affine_matrix_multislice(orientation, position, first[3])
+        shape = (int(first[6]), int(first[5]), locations.size)
+        uids = [row[0] for _, row in images]
+        sources = [source for source, _ in images]
+        result.append((affine, uids, sources, z, shape, first[4]))
+    return result
+
+
+def map_series(source, target, signals=None):
+    """Map the non-zero pixels of one series onto the geometry of another.
+
+    source and target are lists as returned by series_sources(). 
+    Returns the slice groups of the target and the masks returned
+    by map_masks().
+    """
+    target = slice_groups(target)
+    return target, map_masks(slice_groups(source), target, signals)
+
+
+def _map_series(source, target, signals=None):
+    with jobs.reading():
+        return map_series(source, target, signals)
+
+
+def map_masks(source, target, signals=None):
+    """Map the non-zero pixels of one series onto the geometry of another.
+
+    source and target are slice groups as returned by slice_groups().
+    The source images are read once, and each source volume is mapped 
+    once onto each target volume. Returns a list with a boolean array 
+    (x, y, z) for each target slice group.
+    """
+    nimages = sum([len(group[1]) for group in source])
+    cnt = 0
+    percent = None
+    volumes = []
+    for affine, _, sources, z, shape, thickness in source:
+        volume = np.zeros(shape, dtype=bool)
+        for i, image in enumerate(sources):
+            volume[:,:,z[i]] |= read_source(image).get_pixel_array() > 0.5
+            cnt += 1
+            if signals is not None and 100*cnt//nimages != percent:
+                percent = 100*cnt//nimages
+                signals.progress.emit(percent)
+        volumes.append((affine, volume, thickness))
+    masks = []
+    for affine_target, _, _, _, shape, _ in target:
+        mask = np.zeros(shape, dtype=bool)
+        for affine, volume, thickness in volumes:
+            if np.array_equal(affine, affine_target) and volume.shape == shape:
+                mask |= volume
             else:
-                for i, image in np.ndenumerate(images):
-                    if image is not None:
-                        newRegion[image.SOPInstanceUID] = region[:,:,i[0]] != 0
-            self._regions.append(newRegion)
-            self._currentRegion = newRegion
\ No newline at end of file
+                mapped = multislice_affine_transform(
+                    volume[:,:,:,np.newaxis].astype(np.float32), 
+                    affine, 
+                    affine_target, 
+                    output_shape = shape, 
+                    slice_thickness = thickness, 
+                    mask = True,
+                )
+                mask |= mapped[:,:,:,0] > 0.5
+        masks.append(mask)
+    return masks
+
+
+def set_mask_array(ds, mask):
+    """Write a boolean mask to the pixel data of a DICOM dataset.
+
+    The mask is stored as 0 and 1 in uncompressed 8-bit pixels, 
+    without conversion to float or rescaling.
+    """
+    array = np.transpose(mask).astype(np.uint8)
+    for tag in [(0x2005, 0x100E), (0x2005, 0x100D)]: # Philips rescale
+        if tag in ds:
+            del ds[tag]
+    for tag in ['FloatPixelData', 'DoubleFloatPixelData']:
+        if tag in ds:
+            delattr(ds, tag)
+    # The source may be compressed, but the mask is not
+    if not hasattr(ds, 'file_meta'):
+        ds.file_meta = pydicom.dataset.FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.BitsAllocated = 8
+    ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.set_values('SmallestImagePixelValue', 0)
+    ds.set_values('LargestImagePixelValue', 1)
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = 0
+    ds.WindowCenter = 0.5
+    ds.WindowWidth = 1.0
+    ds.Rows = array.shape[0]
+    ds.Columns = array.shape[1]
+    pixels = array.tobytes()
+    if len(pixels) % 2 == 1:
+        pixels += b'\x00'
+    ds.PixelData = pixels
+    ds['PixelData'].VR = 'OB'
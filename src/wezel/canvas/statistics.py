@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class ImageStatistics():
+    """Pixel statistics of an image, computed once when first needed.
+
+    The statistics are shared by all tools that need them, so that
+    the pixels are not scanned again for every interaction. Create
+    a new instance when the array changes.
+    """
+
+    def __init__(self, array):
+        self.array = array
+        self._min = None
+        self._max = None
+        self._order = None
+        self._sorted = None
+        self._finite = None # number of values that are not NaN
+
+    def min(self):
+        if self._min is None:
+            self._min = np.amin(self.array)
+        return self._min
+
+    def max(self):
+        if self._max is None:
+            self._max = np.amax(self.array)
+        return self._max
+
+    def sorted(self):
+        """Flat indices that sort the pixels, and the sorted pixel values"""
+        if self._order is None:
+            self._order = np.argsort(self.array, axis=None)
+            self._sorted = self.array.ravel()[self._order]
+        return self._order, self._sorted
+
+    def percentile(self, q):
+        """Percentiles q (0 to 100) of the pixel values, ignoring NaN.
+
+        Read from the sorted values, with linear interpolation as in 
+        numpy.nanpercentile. Returns NaN if all values are NaN.
+        """
+        _, sorted = self.sorted()
+        if self._finite is None:
+            # NaN values are sorted last
+            self._finite = sorted.size - np.count_nonzero(np.isnan(sorted))
+        n = self._finite
+        if n == 0:
+            return np.full(np.shape(q), np.nan)[()]
+        position = np.asarray(q, dtype=np.float64)*(n-1)/100
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower+1, n-1)
+        lower_value = sorted[lower].astype(np.float64)
+        return lower_value + (position-lower)*(sorted[upper]-lower_value)
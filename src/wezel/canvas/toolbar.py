@@ -75,7 +75,7 @@ class ToolBar(QWidget):
         self.actionRedo.triggered.connect(self.redo)
         self.actionErase.triggered.connect(self.erase)
         self.filters[2].windowChanged.connect(
-            lambda array, center, width, set: self.window.setData(array, center, width, set=set)
+            lambda array, center, width, set: self.window.setData(array, center, width, set=set, stats=self.canvas.imageItem.stats)
         )
 
         # Add filters to action group so only one can be selected
@@ -100,7 +100,7 @@ class ToolBar(QWidget):
         self.canvas.toolBar = self
         self.canvas.setFilter(self.group.checkedAction().filter)
         self.regionList.setCanvas(canvas)
-        self.window.setData(canvas.array(), canvas.center(), canvas.width(), set=True)
+        self.window.setData(canvas.array(), canvas.center(), canvas.width(), set=True, stats=canvas.imageItem.stats)
         mask = canvas.mask()
         if mask is not None:
             canvas.setMask(
@@ -137,14 +137,14 @@ class ToolBar(QWidget):
             self.canvas.setWindow(v[0], v[1])
             self.canvas.setColormap(cmap)
         else:
-            self.window.setData(array, center, width)
+            self.window.setData(array, center, width, stats=self.canvas.imageItem.stats)
             self.filters[2].setChecked(colormap)
 
     def setEditMaskEnabled(self, enable=None):
         if enable is None:
             item = self.canvas.maskItem
-            undoEnable = item._current!=0 and item._current is not None
-            redoEnable = item._current!=len(item._bin)-1 and item._current is not None
+            undoEnable = item.canUndo()
+            redoEnable = item.canRedo()
             # Small bug here - does not reset properly when slices
             # are changed. Skipping for now..
             # if item.bin() is None:
@@ -163,25 +163,22 @@ class ToolBar(QWidget):
     def undo(self):
         item = self.canvas.maskItem
         item.undo()
-        self.canvas.saveMask()
         self.setEditMaskEnabled()
 
     def redo(self):
         item = self.canvas.maskItem
         item.redo()
-        self.canvas.saveMask()
         self.setEditMaskEnabled()
 
     def erase(self):
         item = self.canvas.maskItem
         item.erase()
-        self.canvas.saveMask()
         self.setEditMaskEnabled()
 
     def setDefaultColor(self):
         self.canvas.setWindow()
         self.canvas.setColormap()
-        self.window.setData(self.canvas.array(), self.canvas.center(), self.canvas.width(), set=True)
+        self.window.setData(self.canvas.array(), self.canvas.center(), self.canvas.width(), set=True, stats=self.canvas.imageItem.stats)
         self.filters[2].setChecked('Greyscale')
 
     def menuZoomTo(self, parent=None):
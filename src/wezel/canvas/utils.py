@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 #from PyQt5.QtGui import QImage
 
@@ -7,56 +8,53 @@ from skimage import feature
 import cv2 as cv2
 
 
-def region_grow_add(img, selected, seed, min, max):
-    width, height = img.shape
-    checked = np.copy(selected) 
-    # neighbours = [ #should not include corners?
-    #     [-1, -1], [0, -1], [1, -1], [1, 0], [1, 1], 
-    #     [0, 1], [-1, 1], [-1, 0]
-    # ]
-    neighbours = [ 
-        [0, -1], [1, 0], 
-        [0, 1], [-1, 0],
-    ]
-    while seed != []:
-        p = seed.pop()
-        selected[p[0], p[1]] = True
-        for next in neighbours:
-            x = p[0] + next[0]
-            y = p[1] + next[1]
-            if x < 0 or y < 0 or x >= width or y >= height:
-                continue
-            if not checked[x,y]:
-                checked[x,y] = True
-                if min <= img[x,y] <= max:
-                    seed.append([x,y])
+def region_grow_add(img, selected, seed, min, max, connectivity=4):
+    """Select all pixels in range [min, max] connected to the seeds.
+
+    The region grows through pixels that are not yet selected. 
+    selected is updated in place and returned.
+    """
+    region = (img >= min) & (img <= max) & np.logical_not(selected)
+    selected[region_connected(region, seed, connectivity)] = True
     return selected
 
-def region_grow_remove(img, selected, to_select, min, max):
-    width, height = img.shape
-    checked = np.copy(np.logical_not(selected))
-    # neighbours = [
-    #     [-1, -1], [0, -1], [1, -1], [1, 0], [1, 1], 
-    #     [0, 1], [-1, 1], [-1, 0]
-    # ]
-    neighbours = [ 
-        [0, -1], [1, 0], 
-        [0, 1], [-1, 0],
-    ]
-    while to_select != []:
-        p = to_select.pop()
-        selected[p[0], p[1]] = False
-        for next in neighbours:
-            x = p[0] + next[0]
-            y = p[1] + next[1]
-            if x < 0 or y < 0 or x >= width or y >= height:
-                continue
-            if not checked[x,y]:
-                checked[x,y] = True
-                if min <= img[x,y] <= max:
-                    to_select.append([x,y])
+def region_grow_remove(img, selected, to_select, min, max, connectivity=4):
+    """Deselect all pixels in range [min, max] connected to the seeds.
+
+    The region shrinks through pixels that are selected. 
+    selected is updated in place and returned.
+    """
+    region = (img >= min) & (img <= max) & selected
+    selected[region_connected(region, to_select, connectivity)] = False
     return selected
 
+def region_connected(region, seed, connectivity=4):
+    """Pixels of a region that are connected to a list of seeds, and the seeds.
+
+    A component of the region is connected if it contains a seed 
+    or is a neighbour of one. connectivity is 4 or 8.
+    """
+    connected = np.zeros(region.shape, dtype=bool)
+    seed = np.asarray(seed, dtype=int).reshape(-1, 2)
+    if seed.shape[0] == 0:
+        return connected
+    nr, labels = cv2.connectedComponents(region.view(np.uint8), connectivity=connectivity)
+    if connectivity == 8:
+        dx, dy = np.mgrid[-1:2, -1:2]
+        dx, dy = dx.ravel(), dy.ravel()
+    else:
+        dx = np.array([0, 0, 1, 0, -1])
+        dy = np.array([0, -1, 0, 1, 0])
+    x = (seed[:,0][:,np.newaxis] + dx).ravel()
+    y = (seed[:,1][:,np.newaxis] + dy).ravel()
+    inside = (x >= 0) & (y >= 0) & (x < region.shape[0]) & (y < region.shape[1])
+    found = np.zeros(nr, dtype=bool)
+    found[labels[x[inside], y[inside]]] = True
+    found[0] = False # background
+    connected = found[labels]
+    connected[seed[:,0], seed[:,1]] = True
+    return connected
+
 
 COLORMAPS = [ # This needs to move to dbdicom - list of supported colormaps
     ('Perceptually Uniform Sequential',[
@@ -84,6 +82,48 @@ COLORMAPS = [ # This needs to move to dbdicom - list of supported colormaps
         'tab10', 'tab20', 'tab20b', 'tab20c']),
 ]
 
+def bounding_box(mask):
+    """Smallest rectangle (x0, y0, x1, y1) containing all True pixels of a mask.
+
+    Returns None if the mask is empty.
+    """
+    x = np.flatnonzero(mask.any(axis=1))
+    if x.size == 0:
+        return None
+    y = np.flatnonzero(mask.any(axis=0))
+    return x[0], y[0], x[-1]+1, y[-1]+1
+
+
+@functools.lru_cache(maxsize=32)
+def brush_stencil(size, shape='square'):
+    """Boolean footprint of a brush with odd size"""
+    w = int((size - 1)/2)
+    if shape == 'circle':
+        x, y = np.ogrid[-w:w+1, -w:w+1]
+        stencil = x**2 + y**2 <= (w+0.5)**2
+    else:
+        stencil = np.ones((2*w+1, 2*w+1), dtype=bool)
+    stencil.setflags(write=False)
+    return stencil
+
+
+def brush_stroke(x0, y0, x1, y1, stencil):
+    """Footprint of a brush moved along a line.
+
+    Returns the coordinates of the lower corner of the footprint
+    and the footprint as a boolean array.
+    """
+    w = int((stencil.shape[0] - 1)/2)
+    n = max(abs(x1-x0), abs(y1-y0))
+    xc = np.rint(np.linspace(x0, x1, n+1)).astype(int)
+    yc = np.rint(np.linspace(y0, y1, n+1)).astype(int)
+    x, y = min(x0, x1)-w, min(y0, y1)-w
+    footprint = np.zeros((abs(x1-x0)+2*w+1, abs(y1-y0)+2*w+1), dtype=bool)
+    for i, j in zip(xc-x-w, yc-y-w):
+        footprint[i:i+2*w+1, j:j+2*w+1] |= stencil
+    return x, y, footprint
+
+
 def colormap_to_LUT(cmap):
     if cmap is None:
         cmap = 'Greyscale'
@@ -141,7 +141,13 @@ SMALLSTYLESHEET = """
 
 class Wezel:
 
-    def __init__(self):
+    def __init__(self, cachePath=None, cacheSize=None):
+        """cachePath and cacheSize configure the cache of decoded series
+        (see wezel.cache.set_volumes). cacheSize=0 disables it."""
+        if (cachePath is not None) or (cacheSize is not None):
+            if cacheSize is None:
+                cacheSize = wezel.cache.volumes.maxBytes
+            wezel.cache.set_volumes(cachePath, cacheSize)
         self.log = logger()
         self.QApp = QApplication(sys.argv)
         self.QApp.setWindowIcon(QIcon(wezel.icons.favicon))
@@ -184,6 +190,7 @@ class Main(QMainWindow):
             treeViewDockWidget (QDockWidget): A QDockWidget instance to hold the treeview.
             folder (None): Placeholder for the folder widget.
             central (object): An instance of the MainMultipleDocumentInterface class from the wezel.widgets module.
+            jobs (object): An instance of the JobQueue class from the wezel.jobs module.
         """
 
         super().__init__()
@@ -198,6 +205,7 @@ class Main(QMainWindow):
         self.dialog = wezel.widgets.Dialog(self)
         self.status = wezel.widgets.StatusBar()
         self.setStatusBar(self.status)
+        self.jobs = wezel.jobs.JobQueue(self)
 
         self.toolBar = {}
         self.toolBarDockWidget = QDockWidget()
@@ -258,6 +266,8 @@ class Main(QMainWindow):
         """Closes the application."""
         if self.database() is None:
             return True
+        self.jobs.cancel()
+        self.jobs.wait()
         accept = self.database().close()
         if accept:
             self.toolBarDockWidget.hide()
@@ -267,14 +277,38 @@ class Main(QMainWindow):
             self.menuBar().enable()
         return accept
 
-    def refresh(self):
+    def refresh(self, created=None, removed=None, changed=None):
         """
         Refreshes the Wezel display.
+
+        Actions can list the records they have created, removed or 
+        changed (renamed, moved..). Then only those records are updated 
+        in the display. Without any records the whole database is 
+        compared with the display.
         """
         self.status.message('Refreshing display..')
-        self.treeView.setDatabase()
+        if created is None and removed is None and changed is None:
+            self.treeView.setDatabase()
+        else:
+            records = (created or []) + (removed or []) + (changed or [])
+            self.treeView.updateRecords(records)
+            self.refreshSubWindows(removed=removed, changed=changed)
         self.menuBar().enable()
         self.status.hide()
+
+    def refreshSubWindows(self, removed=None, changed=None):
+        """Close displays of removed series and update the titles of changed series"""
+        for subWindow in self.central.subWindowList():
+            widget = subWindow.widget()
+            if not hasattr(widget, 'series'):
+                continue
+            series = widget.series()
+            if series is None:
+                continue
+            if removed and not series.exists():
+                subWindow.close()
+            elif changed:
+                subWindow.setWindowTitle(series.label())
         
     def display(self, object):
         if object is None:
@@ -505,8 +539,9 @@ class MenuBar(QMenuBar):
         """
         Refreshes the enabled status of each menu item.
         """
+        selection = Selection(self.main)
         for menu in self._menus:
-            menu.enable()
+            menu.enable(selection)
 
 
 class Menu(QMenu):
@@ -520,6 +555,7 @@ class Menu(QMenu):
         self.main = parent.main
         if parent is not None:
             parent.addMenu(self)
+        self.aboutToShow.connect(self._enableActions)
 
     def addMenu(self, menu):
         super().addMenu(menu)
@@ -538,19 +574,73 @@ class Menu(QMenu):
     def separator(self):
         self.addSeparator() 
 
-    def enable(self):
+    def enable(self, selection=None):
         """
         Refreshes the enabled status of each menu item.
+
+        Actions with a shortcut are updated straight away, 
+        the others when the menu is shown.
         """
+        if selection is None:
+            selection = Selection(self.main)
         for submenu in self._menus:
-            submenu.enable()
+            submenu.enable(selection)
+        for action in self._actions:
+            if not action.shortcut().isEmpty():
+                action.updateEnabled(selection)
+        if self.isVisible():
+            self._enableActions()
+
+    def _enableActions(self):
+        selection = Selection(self.main)
         for action in self._actions:
-            enable = action.enable(action.main)
-            action.setEnabled(enable)
+            action.updateEnabled(selection)
+
+
+class Selection():
+    """The state of the application that decides which actions are enabled.
+
+    Actions receive a selection in enable() instead of the application.
+    The number of selected records and the database are read once, and 
+    shared by all actions. Other attributes are those of the application.
+    Two selections with the same key enable the same actions.
+    """
+
+    generations = ['Patients', 'Studies', 'Series', 'Instances']
+
+    def __init__(self, main):
+        self._main = main
+        self._nr_selected = {g: main.nr_selected(g) for g in self.generations}
+        self._database = main.database()
+        isOpen = False if self._database is None else self._database.manager.is_open()
+        activeWindow = main.central.activeWindow
+        self.key = (
+            tuple(self._nr_selected.values()), 
+            id(self._database), isOpen, 
+            None if activeWindow is None else id(activeWindow.widget()),
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._main, name)
+
+    def nr_selected(self, generation):
+        if generation in self._nr_selected:
+            return self._nr_selected[generation]
+        return self._main.nr_selected(generation)
+
+    def database(self):
+        return self._database
 
 
 class Action(QAction):
-    """Base class for all wezel actions"""
+    """Base class for all wezel actions
+
+    An asynchronous action runs in the background. Its prepare() 
+    collects the user input in the GUI, and its run() receives the 
+    input as keyword arguments.
+    """
+
+    asynchronous = False
 
     def __init__(self, parent,
         text = None,
@@ -565,7 +655,7 @@ class Action(QAction):
         if text is None:
             text = self.__class__.__name__
         self.setText(text)
-        self.triggered.connect(lambda: self.run(self.main))
+        self.triggered.connect(lambda: self.start(self.main))
     
         if icon is not None: 
             self.setIcon(QIcon(icon))
@@ -578,9 +668,34 @@ class Action(QAction):
         for option in kwargs:
             self.__dict__[option] = kwargs[option]
 
+        self._enabledFor = None
+
+    def updateEnabled(self, selection):
+        """Enable or disable the action, unless the selection is unchanged"""
+        if selection.key == self._enabledFor:
+            return
+        self._enabledFor = selection.key
+        self.setEnabled(self.enable(selection))
+
     def enable(self, app):
         return True
 
+    def start(self, app):
+        if not self.asynchronous:
+            if app.jobs.jobs != []:
+                msg = 'Please wait until the running jobs are finished, or cancel them.'
+                app.dialog.information(msg, self.text())
+                return
+            self.run(app)
+            return
+        options = self.prepare(app)
+        if options is not None:
+            app.jobs.start(self, options)
+
+    def prepare(self, app):
+        """Returns the keyword arguments of run(), or None to cancel"""
+        return {}
+
     def run(self, app):
         pass
 
@@ -0,0 +1,195 @@
+"""
+`headers` reads selected DICOM tags of many instances, without reading
+the pixel data.
+
+Values read from files are memoized per file, and are read again
+only when the modification time or the size of the file changes,
+so that opening the same series again does not touch the disk.
+Large numbers of files are read in a pool of processes.
+"""
+import os
+import sys
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import pandas as pd
+import pydicom
+from dbdicom.ds.dataset import get_values, get_colormap
+
+
+# Custom attributes of dbdicom datasets that are derived from the header
+HEADER_ATTRIBUTES = {
+    'colormap': get_colormap,
+}
+
+# Minimum number of files to read in a pool of processes
+PROCESS_THRESHOLD = 2000
+
+_cache = {}     # file: (mtime, size, {tag: value})
+_lock = threading.Lock()
+_pool = None
+
+
+def read_dataframe(series, tags):
+    """Read a list of tags for all instances in a series.
+
+    Tags that are columns of the register are taken from the register.
+    Other tags are read from the files, stopping before the pixel data.
+    Instances with changes in memory are read from memory.
+    Returns a dataframe with one row per instance, as series.read_dataframe().
+    """
+    manager = series.manager
+    keys = series.keys()
+    df = manager.register.loc[keys, [tag for tag in tags if tag in manager.columns]]
+    missing = [tag for tag in tags if tag not in manager.columns]
+    if missing != []:
+        values = read_values(manager, keys, missing)
+        df = pd.concat([df, values], axis=1)
+    return df[tags]
+
+
+def read_values(manager, keys, tags):
+    """Dataframe with the values of tags for the instances with the given keys"""
+    # Other custom attributes of dbdicom datasets need the full dataset
+    custom = [t for t in tags if _is_custom(t) and t not in HEADER_ATTRIBUTES]
+    rows = {}
+    files = {}
+    for key in keys:
+        if (custom != []) or (key in manager.dataset) or (manager.path is None):
+            ds = manager.get_instance_dataset(key)
+            rows[key] = [None]*len(tags) if ds is None else ds.get_values(tags)
+        else:
+            files[key] = manager.filepath(key)
+    if files != {}:
+        values = read_files(list(files.values()), tags)
+        for key, row in zip(files.keys(), values.values.tolist()):
+            rows[key] = row
+    return pd.DataFrame([rows[key] for key in keys], index=keys, columns=tags)
+
+
+def read_files(files, tags):
+    """Values of tags in a list of files.
+
+    Returns a dataframe with one row per file (indexed by file) and
+    one column per tag. Only values that are not yet memoized are read.
+    """
+    stats = [_stat(file) for file in files]
+    todo = {}
+    with _lock:
+        for file, stat in zip(files, stats):
+            cached = _cache.get(file)
+            if cached is None or cached[:2] != stat:
+                todo[file] = tags
+            else:
+                missing = [t for t in tags if t not in cached[2]]
+                if missing != []:
+                    todo[file] = missing
+    if todo != {}:
+        _read(todo, stats=dict(zip(files, stats)))
+    with _lock:
+        rows = [_row(file, tags) for file in files]
+    return pd.DataFrame(rows, index=files, columns=tags)
+
+
+def read_file(file, tags):
+    """Values of tags in a file, or None for all tags if it cannot be read"""
+    try:
+        ds = pydicom.dcmread(file, force=True, stop_before_pixels=True)
+    except Exception:
+        return [None]*len(tags)
+    values = iter(get_values(ds, [t for t in tags if t not in HEADER_ATTRIBUTES]))
+    return [HEADER_ATTRIBUTES[t](ds) if t in HEADER_ATTRIBUTES else next(values) for t in tags]
+
+
+def read_header(instance):
+    """Dataset of an instance without the pixel data.
+
+    An instance with changes in memory is returned from memory, in full.
+    """
+    manager = instance.manager
+    key = instance.keys()[0]
+    if (key in manager.dataset) or (manager.path is None):
+        return instance.get_dataset()
+    return pydicom.dcmread(manager.filepath(key), force=True, stop_before_pixels=True)
+
+
+def clear_cache():
+    """Forget all memoized values"""
+    with _lock:
+        _cache.clear()
+
+
+def _read(todo, stats):
+    # Group the files by the tags to read, and read each group
+    groups = {}
+    for file, tags in todo.items():
+        groups.setdefault(tuple(tags), []).append(file)
+    for tags, files in groups.items():
+        tags = list(tags)
+        values = _read_parallel(files, tags)
+        with _lock:
+            for file, row in zip(files, values):
+                stat = stats[file]
+                cached = _cache.get(file)
+                if cached is None or cached[:2] != stat:
+                    cached = (stat[0], stat[1], {})
+                    _cache[file] = cached
+                cached[2].update(zip(tags, row))
+
+
+def _read_parallel(files, tags):
+    # A spawn pool needs mp_context, which is new in Python 3.7
+    processes = sys.version_info >= (3, 7) and os.cpu_count() > 1
+    if processes and len(files) >= PROCESS_THRESHOLD:
+        try:
+            return _read_processes(files, tags)
+        except Exception:
+            # A pool that cannot be started (for instance in a frozen
+            # application without freeze_support) falls back to threads.
+            _shutdown()
+    with ThreadPoolExecutor() as pool:
+        return list(pool.map(lambda file: read_file(file, tags), files))
+
+
+def _read_processes(files, tags):
+    global _pool
+    if _pool is None:
+        context = multiprocessing.get_context('spawn')
+        _pool = ProcessPoolExecutor(mp_context=context)
+    # Send the files in chunks to limit the overhead per file
+    n = 4*os.cpu_count()
+    chunks = [files[i::n] for i in range(n)]
+    results = list(_pool.map(_read_chunk, chunks, [tags]*n))
+    values = {}
+    for chunk, rows in zip(chunks, results):
+        values.update(zip(chunk, rows))
+    return [values[file] for file in files]
+
+
+def _read_chunk(files, tags):
+    return [read_file(file, tags) for file in files]
+
+
+def _shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _stat(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return (None, None)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _row(file, tags):
+    values = _cache[file][2]
+    return [values[t] for t in tags]
+
+
+def _is_custom(tag):
+    return isinstance(tag, str) and pydicom.datadict.tag_for_keyword(tag) is None
@@ -0,0 +1,185 @@
+"""
+`jobs` runs asynchronous actions in the background.
+
+The run() of an asynchronous action is executed in a worker thread,
+so that the window stays responsive. Progress is shown in the status
+bar, which also lists the queue of jobs and allows them to be cancelled.
+The display is updated when a job is finished.
+
+dbdicom databases are not thread-safe, so jobs run one at a time, and 
+the next job starts after the display has been updated. Nothing else 
+reads the database while a job runs: threads that read it in the 
+background wait in reading(), and the displays and the folder tree, 
+which read it in the GUI, are disabled.
+"""
+import contextlib
+
+from PyQt5.QtCore import QObject, QThreadPool, QReadWriteLock
+from PyQt5.QtWidgets import QApplication
+
+from wezel.widgets.log_to_GUI import Worker, Cancelled
+
+
+GENERATIONS = ['Patients', 'Studies', 'Series', 'Instances']
+
+# Held for writing by the running job, and for reading by background readers
+_lock = QReadWriteLock()
+
+
+@contextlib.contextmanager
+def reading():
+    """Context for reading the database outside of the GUI thread.
+
+    Waits until the running job, if any, is finished. A job that is 
+    started meanwhile waits until the context is left.
+    """
+    _lock.lockForRead()
+    try:
+        yield
+    finally:
+        _lock.unlock()
+
+
+class Job():
+    """
+    Stands in for the application in the run() of an asynchronous action.
+
+    The selection is taken when the job is started. Refreshing and
+    displaying records are postponed until the job is finished.
+    """
+
+    def __init__(self, queue, main, title):
+        self.queue = queue
+        self.title = title
+        self.status = main.status
+        self.worker = None
+        self.cancelled = False
+        self.failed = False
+        self.refreshed = []
+        self.displayed = []
+        self._database = main.database()
+        self._selected = {}
+        for generation in GENERATIONS:
+            if main.nr_selected(generation) != 0:
+                self._selected[generation] = main.selected(generation)
+
+    def cancel(self):
+        self.queue.cancel(self)
+
+    def database(self):
+        return self._database
+
+    def selected(self, generation='Series'):
+        if generation == 'Databases':
+            return [] if self._database is None else [self._database]
+        return self._selected.get(generation, [])
+
+    def nr_selected(self, generation):
+        return len(self.selected(generation))
+
+    def refresh(self, created=None, removed=None, changed=None):
+        self.refreshed.append((created, removed, changed))
+
+    def display(self, object):
+        self.displayed.append(object)
+
+
+class JobQueue(QObject):
+    """Runs asynchronous actions one at a time"""
+
+    def __init__(self, main):
+        super().__init__()
+        self.main = main
+        self.jobs = []
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+
+    def start(self, action, options):
+        """Queue the run() of an action with options returned by prepare()"""
+        job = Job(self, self.main, action.text())
+        job.worker = Worker(_run, action, job, options)
+        job.worker.signals.error.connect(lambda error: self._error(job, error))
+        job.worker.signals.finished.connect(lambda: self._finished(job))
+        self.jobs.append(job)
+        self.main.status.setJobs(self.jobs)
+        if len(self.jobs) == 1:
+            self._setDisplaysEnabled(False)
+            self.pool.start(job.worker)
+        return job
+
+    def cancel(self, job=None):
+        """Cancel a job, or all jobs if none is given"""
+        jobs = list(self.jobs) if job is None else [job]
+        for job in jobs:
+            if job not in self.jobs:
+                continue
+            job.cancelled = True
+            if job is self.jobs[0]:
+                # The running job stops at its next progress update
+                job.worker.cancel()
+            else:
+                self.jobs.remove(job)
+                self.main.status.message(job.title + ' cancelled')
+        self.main.status.setJobs(self.jobs)
+
+    def wait(self):
+        """Wait until all jobs are finished, and apply their results"""
+        while self.jobs != []:
+            self.pool.waitForDone()
+            QApplication.processEvents()
+
+    def _error(self, job, error):
+        exctype, value, traceback = error
+        job.failed = True
+        if exctype is Cancelled:
+            job.cancelled = True
+        else:
+            self.main.dialog.error(str(value), job.title + ' failed')
+
+    def _finished(self, job):
+        self.jobs.remove(job)
+        self.main.status.setJobs(self.jobs)
+        if self.jobs == []:
+            self._setDisplaysEnabled(True)
+        if self.main.database() is job.database():
+            self._apply(job)
+        if self.jobs != []:
+            self.pool.start(self.jobs[0].worker)
+
+    def _setDisplaysEnabled(self, enabled):
+        # The displays and the folder tree read the database in the GUI
+        for widget in [self.main.central, self.main.treeViewDockWidget, self.main.toolBarDockWidget]:
+            widget.setEnabled(enabled)
+
+    def _apply(self, job):
+        if job.failed:
+            # Records may have been created before the job stopped
+            self.main.refresh()
+        elif job.refreshed != []:
+            _refresh(self.main, job.refreshed)
+        for object in job.displayed:
+            if object is not None and object.exists():
+                self.main.display(object)
+        if job.cancelled:
+            self.main.status.message(job.title + ' cancelled')
+
+
+def _run(action, job, options, signals=None):
+    _lock.lockForWrite()
+    try:
+        action.run(job, **options)
+    finally:
+        _lock.unlock()
+
+
+def _refresh(main, refreshed):
+    # Merge the refreshes requested by a job into one
+    if any(records == (None, None, None) for records in refreshed):
+        main.refresh()
+        return
+    created, removed, changed = [], [], []
+    for c, r, ch in refreshed:
+        created += c or []
+        removed += r or []
+        changed += ch or []
+    main.refresh(created=created, removed=removed, changed=changed)
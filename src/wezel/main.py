@@ -29,9 +29,9 @@ import venv
 from wezel.core import Wezel
 
 
-def app():
+def app(**kwargs):
 
-    return Wezel()
+    return Wezel(**kwargs)
 
 
 
@@ -1,6 +1,7 @@
 import numpy as np
 import dbdicom as db
 import wezel
+from wezel import headers
 
 
 def all(parent):
@@ -43,10 +44,11 @@ class Copy(wezel.Action):
         app.status.message("Copying..")
         records = app.selected(self.generation)   
         # This can be faster - copy all in one go     
+        copies = []
         for j, record in enumerate(records):
             #app.status.progress(j, len(records), 'Copying..')
-            record.copy()               
-        app.refresh()
+            copies.append(record.copy())
+        app.refresh(created=copies)
 
 
 class Delete(wezel.Action):
@@ -60,7 +62,7 @@ class Delete(wezel.Action):
         for j, record in enumerate(records):
             app.status.progress(j, len(records), 'Deleting..')
             record.remove()
-        app.refresh()
+        app.refresh(removed=records)
 
 
 class DeleteSeries(wezel.Action):
@@ -73,7 +75,7 @@ class DeleteSeries(wezel.Action):
         for j, sery in enumerate(series):
             app.status.progress(j, len(series), 'Deleting..')
             sery.remove()
-        app.refresh()
+        app.refresh(removed=series)
 
 class DeleteStudies(wezel.Action):
 
@@ -85,7 +87,7 @@ class DeleteStudies(wezel.Action):
         for j, study in enumerate(studies):
             app.status.progress(j, len(studies), 'Deleting..')
             study.remove()
-        app.refresh()
+        app.refresh(removed=studies)
 
 class CopySeries(wezel.Action):
 
@@ -105,7 +107,7 @@ class CopySeries(wezel.Action):
         for j, sery in enumerate(series):
             app.status.progress(j, len(series), 'Moving..')
             sery.copy_to(study)               
-        app.refresh()
+        app.refresh(changed=[study])
 
 
 class MoveSeries(wezel.Action):
@@ -126,7 +128,7 @@ class MoveSeries(wezel.Action):
         for j, sery in enumerate(series):
             app.status.progress(j, len(series), 'Moving..')
             sery.move_to(study)               
-        app.refresh()
+        app.refresh(changed=series+[study])
 
 
 class MoveStudies(wezel.Action):
@@ -147,7 +149,7 @@ class MoveStudies(wezel.Action):
         for j, study in enumerate(studies):
             app.status.progress(j, len(studies), 'Moving..')
             study.move_to(patient)               
-        app.refresh()
+        app.refresh(changed=studies+[patient])
 
 
 class CopyStudies(wezel.Action):
@@ -168,7 +170,7 @@ class CopyStudies(wezel.Action):
         for j, study in enumerate(studies):
             app.status.progress(j, len(studies), 'Copying..')
             study.copy_to(patient)
-        app.refresh()
+        app.refresh(changed=[patient])
 
 
 class NewSeries(wezel.Action):
@@ -179,9 +181,8 @@ class NewSeries(wezel.Action):
     def run(self, app): 
         app.status.message('Creating new series..')
         studies = app.selected('Studies')
-        for study in studies:
-            study.new_series(SeriesDescription='New series')
-        app.refresh()
+        series = [study.new_series(SeriesDescription='New series') for study in studies]
+        app.refresh(created=series)
 
 
 class NewStudy(wezel.Action):
@@ -192,9 +193,8 @@ class NewStudy(wezel.Action):
     def run(self, app): 
         app.status.message('Creating new study..')
         patients = app.selected('Patients')
-        for patient in patients:
-            patient.new_study(StudyDescription='New study')
-        app.refresh()
+        studies = [patient.new_study(StudyDescription='New study') for patient in patients]
+        app.refresh(created=studies)
 
 
 class NewPatient(wezel.Action):
@@ -204,8 +204,8 @@ class NewPatient(wezel.Action):
 
     def run(self, app): 
         app.status.message('Creating new patient..')
-        app.database().new_patient(PatientName='New patient')
-        app.refresh()
+        patient = app.database().new_patient(PatientName='New patient')
+        app.refresh(created=[patient])
 
 
 class MergeSeries(wezel.Action):
@@ -221,7 +221,7 @@ class MergeSeries(wezel.Action):
         study = records[0].parent()
         series = study.new_series(SeriesDescription='Merged series')
         db.merge(records, series)
-        app.refresh()
+        app.refresh(created=[series])
 
 
 class MergeStudies(wezel.Action):
@@ -234,7 +234,7 @@ class MergeStudies(wezel.Action):
         studies = app.selected('Studies')
         patient = studies[0].new_pibling(PatientName='Merger')
         db.merge(studies, patient.new_study(StudyDescription='Merged studies'))
-        app.refresh()
+        app.refresh(created=[patient])
 
 class MergePatients(wezel.Action):
 
@@ -246,7 +246,7 @@ class MergePatients(wezel.Action):
         records = app.selected('Patients')
         patient = records[0].new_sibling(PatientName='Merged Patients')
         db.merge(records, patient)
-        app.refresh()
+        app.refresh(created=[patient])
 
 
 class GroupSeries(wezel.Action):
@@ -260,7 +260,7 @@ class GroupSeries(wezel.Action):
         study = records[0].new_pibling(StudyDescription='Grouped')
         db.group(records, study)
         app.status.hide()
-        app.refresh()
+        app.refresh(created=[study], changed=records)
 
 class GroupStudies(wezel.Action):
 
@@ -273,7 +273,7 @@ class GroupStudies(wezel.Action):
         patient = records[0].new_pibling(PatientName='Grouped')
         db.group(records, patient)
         app.status.hide()
-        app.refresh()
+        app.refresh(created=[patient], changed=records)
 
 
 class SeriesRename(wezel.Action):
@@ -290,7 +290,7 @@ class SeriesRename(wezel.Action):
             if cancel:
                 return
             s.SeriesDescription = f[0]['value']
-        app.refresh()
+        app.refresh(changed=series_list)
 
 
 class StudiesRename(wezel.Action):
@@ -299,14 +299,15 @@ class StudiesRename(wezel.Action):
         return app.nr_selected('Studies') != 0
 
     def run(self, app): 
-        for s in app.selected('Studies'):
+        studies = app.selected('Studies')
+        for s in studies:
             cancel, f = app.dialog.input(
                 {"type":"string", "label":"New study name:", "value": s.StudyDescription},
                 title = 'Enter new study name')
             if cancel:
                 return
             s.StudyDescription = f[0]['value']
-        app.refresh()
+        app.refresh(changed=studies)
 
 
 class PatientsRename(wezel.Action):
@@ -315,14 +316,15 @@ class PatientsRename(wezel.Action):
         return app.nr_selected('Patients') != 0
 
     def run(self, app): 
-        for patient in app.selected('Patients'):
+        patients = app.selected('Patients')
+        for patient in patients:
             cancel, f = app.dialog.input(
                 {"type":"string", "label":"New patient name:", "value": patient.PatientName},
                 title = 'Enter new patient name')
             if cancel:
                 return
             patient.PatientName = f[0]['value']
-        app.refresh()
+        app.refresh(changed=patients)
 
 
 class SeriesExtractByIndex(wezel.Action):
@@ -363,7 +365,7 @@ class SeriesExtractByIndex(wezel.Action):
         new_series = series.new_sibling(SeriesDescription = slices[0,0,0].SeriesDescription + indices)
         #db.copy_to(slices[x0:x1,t0:t1,:], new_series)
         new_series.adopt(np.ravel(slices[x0:x1,t0:t1,:]).tolist())
-        app.refresh()
+        app.refresh(created=[new_series])
 
 
 class SeriesExtractByValue(wezel.Action):
@@ -375,12 +377,10 @@ class SeriesExtractByValue(wezel.Action):
 
         # Get source data
         series = app.selected('Series')[0]
-        slice_locations = series.SliceLocation
-        if not isinstance(slice_locations, list):
-            slice_locations = [slice_locations]
-        acquisition_times = series.AcquisitionTime
-        if not isinstance(acquisition_times, list):
-            acquisition_times = [acquisition_times]
+        series.status.message('Reading headers..')
+        df = headers.read_dataframe(series, ['SliceLocation', 'AcquisitionTime'])
+        slice_locations = _unique(df.SliceLocation.values)
+        acquisition_times = _unique(df.AcquisitionTime.values)
         series.status.hide()
 
         # Get user input
@@ -396,14 +396,9 @@ class SeriesExtractByValue(wezel.Action):
             acquisition_times = [acquisition_times[i] for i in f[1]['value']]
 
         # Find matching instances
-        all = series.instances()
-        instances = []
-        for i, instance in enumerate(all):
-            series.status.progress(i, len(all), 'Finding instances..')
-            v = instance[['SliceLocation', 'AcquisitionTime']]
-            if (v[0] in slice_locations) and (v[1] in acquisition_times):
-                instances.append(instance)
-        series.status.hide()
+        # (pandas isin as the columns may hold None next to strings)
+        selected = df.SliceLocation.isin(slice_locations) & df.AcquisitionTime.isin(acquisition_times)
+        instances = [series.instance(key=key) for key in df.index[selected.values]]
         if instances == []:
             return
 
@@ -413,4 +408,14 @@ class SeriesExtractByValue(wezel.Action):
         new_series = series.new_sibling(SeriesDescription = desc)
         new_series.adopt(instances)
         series.status.hide()
-        app.refresh()
\ No newline at end of file
+        app.refresh(created=[new_series])
+
+
+def _unique(values):
+    """Unique values in order of appearance, sorted if possible"""
+    values = list(dict.fromkeys(values))
+    try:
+        values.sort()
+    except TypeError:
+        pass
+    return values
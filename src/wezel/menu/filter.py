@@ -26,10 +26,12 @@ def all(parent):
 
 class FourierEllipsoidFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         size = 2.0
@@ -44,6 +46,12 @@ class FourierEllipsoidFilter(wezel.Action):
         # update defaults
         size = f[0]['value']
 
+        return {
+            'size': size,
+        }
+
+    def run(self, app, size):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
@@ -56,10 +64,12 @@ class FourierEllipsoidFilter(wezel.Action):
 
 class FourierUniformFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         size = 2.0
@@ -74,6 +84,12 @@ class FourierUniformFilter(wezel.Action):
         # update defaults
         size = f[0]['value']
 
+        return {
+            'size': size,
+        }
+
+    def run(self, app, size):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
@@ -86,10 +102,12 @@ class FourierUniformFilter(wezel.Action):
 
 class FourierGaussianFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         sigma = 2.0
@@ -104,6 +122,12 @@ class FourierGaussianFilter(wezel.Action):
         # update defaults
         sigma = f[0]['value']
 
+        return {
+            'sigma': sigma,
+        }
+
+    def run(self, app, sigma):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
@@ -116,10 +140,12 @@ class FourierGaussianFilter(wezel.Action):
 
 class GaussianGradientMagnitudeFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -141,12 +167,20 @@ class GaussianGradientMagnitudeFilter(wezel.Action):
         mode = f[1]['value']
         cval = f[2]['value']
 
+        return {
+            'sigma': sigma,
+            'mode': modes[mode],
+            'cval': cval,
+        }
+
+    def run(self, app, sigma, mode, cval):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.gaussian_gradient_magnitude(
                 sery, sigma,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
             )
             app.display(resized)
@@ -155,10 +189,12 @@ class GaussianGradientMagnitudeFilter(wezel.Action):
 
 class GaussianLaplaceFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -180,12 +216,20 @@ class GaussianLaplaceFilter(wezel.Action):
         mode = f[1]['value']
         cval = f[2]['value']
 
+        return {
+            'sigma': sigma,
+            'mode': modes[mode],
+            'cval': cval,
+        }
+
+    def run(self, app, sigma, mode, cval):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.gaussian_laplace(
                 sery, sigma,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
             )
             app.display(resized)
@@ -194,10 +238,12 @@ class GaussianLaplaceFilter(wezel.Action):
 
 class LaplaceFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -216,12 +262,19 @@ class LaplaceFilter(wezel.Action):
         mode = f[0]['value']
         cval = f[1]['value']
 
+        return {
+            'mode': modes[mode],
+            'cval': cval,
+        }
+
+    def run(self, app, mode, cval):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.laplace(
                 sery,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
             )
             app.display(resized)
@@ -230,10 +283,12 @@ class LaplaceFilter(wezel.Action):
 
 class SobelFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -255,13 +310,21 @@ class SobelFilter(wezel.Action):
         mode = f[1]['value']
         cval = f[2]['value']
 
+        return {
+            'axis': axis,
+            'mode': modes[mode],
+            'cval': cval,
+        }
+
+    def run(self, app, axis, mode, cval):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.sobel_filter(
                 sery,
                 axis = axis,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
             )
             app.display(resized)
@@ -270,10 +333,12 @@ class SobelFilter(wezel.Action):
 
 class PrewittFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -295,13 +360,21 @@ class PrewittFilter(wezel.Action):
         mode = f[1]['value']
         cval = f[2]['value']
 
+        return {
+            'axis': axis,
+            'mode': modes[mode],
+            'cval': cval,
+        }
+
+    def run(self, app, axis, mode, cval):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.prewitt_filter(
                 sery,
                 axis = axis,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
             )
             app.display(resized)
@@ -310,10 +383,12 @@ class PrewittFilter(wezel.Action):
 
 class MedianFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -348,13 +423,23 @@ class MedianFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.median_filter(
                 sery,
                 size = size,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
                 origin = [hshift, vshift],
             )
@@ -364,10 +449,12 @@ class MedianFilter(wezel.Action):
 
 class PercentileFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -405,13 +492,24 @@ class PercentileFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'percentile': percentile,
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, percentile, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.percentile_filter(
                 sery, percentile,
                 size = size,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
                 origin = [hshift, vshift],
             )
@@ -421,10 +519,12 @@ class PercentileFilter(wezel.Action):
 
 class RankFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -462,6 +562,17 @@ class RankFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'rank': rank,
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, rank, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
@@ -469,24 +580,25 @@ class RankFilter(wezel.Action):
                 resized = scipy.rank_filter(
                     sery, rank,
                     size = size,
-                    mode = modes[mode],
+                    mode = mode,
                     cval = cval,
                     origin = [hshift, vshift],
                 )
             except Exception as e:
                 msg = str(e) + '\n Please try again with different parameters'
-                app.dialog.error(msg)
-            else:
-                app.display(resized)
+                raise ValueError(msg)
+            app.display(resized)
         app.refresh()
 
 
 class MaximumFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -521,13 +633,23 @@ class MaximumFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.maximum_filter(
                 sery, 
                 size = size,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
                 origin = [hshift, vshift],
             )
@@ -537,10 +659,12 @@ class MaximumFilter(wezel.Action):
 
 class MinimumFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -575,13 +699,23 @@ class MinimumFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.minimum_filter(
                 sery, 
                 size = size,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
                 origin = [hshift, vshift],
             )
@@ -591,10 +725,12 @@ class MinimumFilter(wezel.Action):
 
 class UniformFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Default settings
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -629,13 +765,23 @@ class UniformFilter(wezel.Action):
                 msg = 'Invalid shift value: shifts must be less than half of the size'
                 app.dialog.information(msg, 'Invalid input value')
 
+        return {
+            'size': size,
+            'mode': modes[mode],
+            'cval': cval,
+            'hshift': hshift,
+            'vshift': vshift,
+        }
+
+    def run(self, app, size, mode, cval, hshift, vshift):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.uniform_filter(
                 sery, 
                 size = size,
-                mode = modes[mode],
+                mode = mode,
                 cval = cval,
                 origin = [hshift, vshift],
             )
@@ -645,10 +791,12 @@ class UniformFilter(wezel.Action):
 
 class GaussianFilter(wezel.Action): 
 
+    asynchronous = True
+
     def enable(self, app):
         return app.nr_selected('Series') != 0
 
-    def run(self, app):
+    def prepare(self, app):
 
         # Get user input
         modes = ['reflect', 'constant', 'nearest', 'mirror', 'wrap']
@@ -662,15 +810,25 @@ class GaussianFilter(wezel.Action):
         if cancel: 
             return
 
+        return {
+            'sigma': f[0]['value'],
+            'order': f[1]['value'],
+            'mode': modes[f[2]['value']],
+            'cval': f[3]['value'],
+            'truncate': f[4]['value'],
+        }
+
+    def run(self, app, sigma, order, mode, cval, truncate):
+
         # Filter series
         series = app.selected('Series')
         for sery in series:
             resized = scipy.gaussian_filter(
-                sery, f[0]['value'],
-                order = f[1]['value'],
-                mode = modes[f[2]['value']],
-                cval = f[3]['value'],
-                truncate = f[4]['value'],
+                sery, sigma,
+                order = order,
+                mode = mode,
+                cval = cval,
+                truncate = truncate,
             )
             app.display(resized)
         app.refresh()
@@ -1,6 +1,7 @@
 import os
 import wezel
 import dbdicom as db
+from wezel import cache
 
 
 def all(parent):
@@ -66,6 +67,7 @@ class Read(wezel.Action):
         """
         app.status.cursorToHourglass()
         app.central.closeAllSubWindows()
+        cache.volumes.invalidate(cache.all_series(app.database()))
         app.database().scan()
         app.status.cursorToNormal() 
         app.refresh()
@@ -82,6 +84,7 @@ class Restore(wezel.Action):
         """
         Restore the open DICOM folder.
         """
+        cache.volumes.invalidate(cache.modified_series(app.database()))
         app.database().restore()
         app.refresh()
 
@@ -97,6 +100,7 @@ class Save(wezel.Action):
         """
         Saves the open DICOM folder.
         """
+        cache.volumes.invalidate(cache.modified_series(app.database()))
         app.database().save()
 
 
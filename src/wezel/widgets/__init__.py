@@ -17,6 +17,7 @@ from .series_sliders import (
 from .series_display import (
     SeriesDisplay,
     SeriesDisplay4D,
+    TimeCurves,
 )
 from .plot_curve import (
     PlotCurve,
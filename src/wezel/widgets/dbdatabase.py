@@ -1,140 +1,112 @@
-from PyQt5.QtCore import  Qt, pyqtSignal
-from PyQt5.QtWidgets import (
-    QAbstractItemView,
-    QTreeWidget, QTreeWidgetItem, QFileSystemModel, QTreeView,
-)
+from PyQt5.QtCore import Qt, pyqtSignal, QAbstractItemModel, QModelIndex
+from PyQt5.QtWidgets import QAbstractItemView, QTreeView
 
-class DICOMFolderTree(QTreeWidget):
-    """Displays a DICOM folder as a Tree."""
+
+LEVELS = ['Patient', 'Study', 'Series']
+UIDS = ['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID']
+# Register columns that the labels depend on
+LABELS = [['PatientName'], ['StudyDescription', 'StudyDate'], ['SeriesNumber', 'SeriesDescription']]
+
+
+class DICOMFolderTree(QTreeView):
+    """Displays a DICOM folder as a Tree.
+
+    Rows are created when their parent is expanded. Databases with
+    up to expandLimit series are shown fully expanded.
+    """
 
     itemSelectionChanged = pyqtSignal(dict)
     itemDoubleClicked = pyqtSignal(dict)
     databaseSet = pyqtSignal()
 
+    expandLimit = 1000
+
     def __init__(self, folder):
         super().__init__()
 
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.itemDoubleClicked.connect(lambda item, col: self._itemDoubleClickedEvent(item, col))
-        self.itemClicked.connect(lambda item, col: self._itemClickedEvent(item, col))
-        # self.setModel(QFileSystemModel()) #This only works for QTreeView
+        self.setUniformRowHeights(True)
+        self.doubleClicked.connect(self._itemDoubleClickedEvent)
+        self.clicked.connect(self._itemClickedEvent)
+        self._model = DICOMFolderModel()
+        self._model.rowsInserted.connect(self._rowsInserted)
+        self.setModel(self._model)
         self._database = None
+        self._expand = False
         self.setDatabase(folder)
 
     def database(self):
         return self._database
 
     def setDatabase(self, folder=None):
-        if folder is not None: 
-            self._database=folder
-        self.dict = {
-            'label': self._database.manager.path,
-            'level': 'Database',
-            'uid': 'Database',
-            'key': None,
-        }
-        self.setUpdatesEnabled(False)
-        self.clear()
-        self.setHeaderLabels([self._database.manager.path])
-        # This does not show empty patients or studies
-        database = self._database.manager.tree()
-        for patient in database['patients']:
-            patientWidget = self._treeWidgetItem('Patient', patient, self)
-            for study in patient['studies']:
-                studyWidget = self._treeWidgetItem('Study', study, patientWidget)
-                for sery in study['series']:
-                    seriesWidget = self._treeWidgetItem('Series', sery, studyWidget)
-        self.setUpdatesEnabled(True)
+        """Show a new database, or refresh the current one"""
+        if folder is None or folder is self._database:
+            self._model.refresh()
+        else:
+            self._database = folder
+            self._model.setDatabase(folder)
+            self._expand = self._model.count('Series') <= self.expandLimit
+            if self._expand:
+                self.expandAll()
+        self.dict = self._model.dict(self._model.root)
         #self.databaseSet.emit()
 
+    def updateRecords(self, records):
+        """Update the rows of records that were created, removed or changed"""
+        self._model.updateRecords(records)
 
-    def _treeWidgetItem(self, level, record, parent, expanded=True):
-        """Build an item in the Tree"""
-
-        item = QTreeWidgetItem(parent)
-        # Custom attributes
-        item.checked = False
-        item.dict = {
-            'label': self._database.manager.label(key=record['key'], type=level),
-            'level': level,
-            'uid': record['uid'],
-            'key': record['key'],
-        }
-        # Built-in attributes
-        item.setText(0, item.dict['label'])
-        item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable)
-        item.setCheckState(0, Qt.Unchecked)
-        item.setExpanded(expanded)
-        return item
+    def _rowsInserted(self, parent, first, last):
+        # New rows are expanded as the rest of the tree
+        if self._expand and parent.isValid():
+            for row in range(first, last+1):
+                self.expandRecursively(self._model.index(row, 0, parent))
 
+    def mousePressEvent(self, event):
+        self._model.toggled = None
+        super().mousePressEvent(event)
 
-    def _itemDoubleClickedEvent(self, item, col):
-        self.itemDoubleClicked.emit(item.dict)
+    def _itemDoubleClickedEvent(self, index):
+        self.itemDoubleClicked.emit(self._model.dict(index.internalPointer()))
 
-    def _itemClickedEvent(self, item, col):
+    def _itemClickedEvent(self, index):
         """Update checked state of children and parents"""
 
-        self.setUpdatesEnabled(False)
-        #item.treeWidget().blockSignals(True)
-        if was_toggled(item):
-            checked = item.checkState(0) == Qt.Checked
-            _set_checked(item, checked)
-            #_check_children(item, item.checked)
-        else:       
-            selectedItems = self.selectedItems()
-            if selectedItems:
-                if len(selectedItems) == 1:
-                    checked = item.checkState(0) == Qt.Checked
+        node = index.internalPointer()
+        if self._model.toggled is not node:
+            selectedRows = self.selectionModel().selectedRows()
+            if selectedRows:
+                if len(selectedRows) == 1:
+                    checked = self._model.isChecked(node.uid)
                     self.uncheck_all()
-                    _set_checked(item, not checked)
+                    self._model.setChecked(node.uid, not checked)
                 else:
                     self.uncheck_all()
-                    for i in selectedItems:
-                        _set_checked(i, True) 
-        #item.treeWidget().blockSignals(False)
-        self.setUpdatesEnabled(True)
-        self.itemSelectionChanged.emit(item.dict)
-
+                    for i in selectedRows:
+                        self._model.setChecked(i.internalPointer().uid, True)
+        self._model.toggled = None
+        self.itemSelectionChanged.emit(self._model.dict(node))
 
     def selectRecords(self, uid, checked=True):
 
-        root = self.invisibleRootItem()
-        if uid == 'Database':
-            _check_children(root, checked)
-        else:
-            generation = [root]
-            for _ in range(3):
-                generation = _children(generation)
-                for item in generation:
-                    if item.dict['uid'] == uid:
-                        _set_checked(item, checked)
-                        return
+        self._model.setChecked(uid, checked)
 
     def uncheck_all(self):
         """Uncheck all TreeView items."""
 
         self.selectRecords('Database', False)
 
-
     def get_selected(self, generation=1):
-        if generation == 4: 
-            return []
-        try:
-            root = self.invisibleRootItem()
-        except RuntimeError:
+        if generation == 4:
             return []
         if generation == 0:
             records = []
             for gen in [1,2,3]:
                 records += self.get_selected(gen)
             return records
-        items = _children([root])
-        while generation > 1:
-            items = _children(items)
-            generation -= 1
+        level = LEVELS[generation-1]
         return [
-            self._database.record(i.dict['level'], i.dict['uid']) 
-            for i in items if i.checkState(0) == Qt.Checked
+            self._database.record(level, uid)
+            for uid in self._model.checked(generation)
         ]
 
     def selected(self, generation):
@@ -147,9 +119,9 @@ class DICOMFolderTree(QTreeWidget):
                 generation=3
             elif generation == 'Instances':
                 generation=4
-        if generation == 4: 
-            return []  
-        return self.get_selected(generation) 
+        if generation == 4:
+            return []
+        return self.get_selected(generation)
 
     def nr_selected(self, generation):
         if isinstance(generation, str):
@@ -161,38 +133,366 @@ class DICOMFolderTree(QTreeWidget):
                 generation=3
             elif generation == 'Instances':
                 generation=4
-        selected = self.get_selected(generation)
-        return len(selected)            
-
-def was_toggled(item):
-
-    checked = item.checkState(0) == Qt.Checked
-    return checked != item.checked
+        if generation == 0:
+            return sum([self._model.nrChecked(gen) for gen in [1,2,3]])
+        if generation == 4:
+            return 0
+        return self._model.nrChecked(generation)
 
-def _set_checked(item, checked):
-    """Check or uncheck an item"""
 
-    if checked: 
-        item.setCheckState(0, Qt.Checked)
-        #item.setSelected(True)
-    else: 
-        item.setCheckState(0, Qt.Unchecked)
-        #item.setSelected(False)
-    item.checked = checked
-    _check_children(item, checked)
+class DICOMFolderModel(QAbstractItemModel):
+    """Tree of patients, studies and series in the register of a database.
 
+    The structure of the tree is read from the register in one pass,
+    but rows are only created when their parent is expanded, and labels
+    are only built when they are displayed. A refresh compares the
+    register with the rows that exist, and only inserts, removes or
+    updates the rows that have changed.
+    """
 
-def _check_children(item, checked):
-    """Set the checkstate of all children of an item."""
+    def __init__(self):
+        super().__init__()
+        self.toggled = None     # Node that was last checked or unchecked by the user
+        self.root = _Node('Database', 'Database', None, None)
+        self.root.label = ''
+        self._database = None
+        self._children = {}     # uid: list of child uids
+        self._records = {}      # uid: (level, key, label columns)
+        self._parents = {}      # uid: uid of parent
+        self._nodes = {}        # uid: node, for the rows that exist
+        self._checked = {level: set() for level in LEVELS}
+
+    def setDatabase(self, folder):
+        self.beginResetModel()
+        self._database = folder
+        self.root = _Node('Database', 'Database', None, None)
+        self.root.label = folder.manager.path
+        self._nodes = {}
+        self._checked = {level: set() for level in LEVELS}
+        self._readRegister()
+        self._fetch(self.root)
+        self.endResetModel()
+
+    def refresh(self):
+        """Update the rows that have changed in the register"""
+        if self._database is None:
+            return
+        self._readRegister()
+        self._update(self.root)
+
+    def updateRecords(self, records):
+        """Update the rows of records that were created, removed or changed.
+
+        Only the patients that the records belonged to, or now belong 
+        to, are read again from the register.
+        """
+        if self._database is None:
+            return
+        uids = {}
+        patients = set()
+        for record in records:
+            level = record.type()
+            if level not in LEVELS:
+                self.refresh()
+                return
+            uids.setdefault(level, []).append(record.uid)
+            patients.add(self._top(record.uid))
+        register = self._database.manager.register
+        for level, values in uids.items():
+            rows = register[UIDS[LEVELS.index(level)]].isin(values)
+            patients.update(register.loc[rows, 'PatientID'].dropna())
+        patients.discard(None)
+        self._readRegister(patients)
+        self._update(self.root, patients)
+
+    def count(self, level):
+        """Number of records of a given level in the database"""
+        return sum([1 for record in self._records.values() if record[0] == level])
+
+    def dict(self, node):
+        return {
+            'label': self._label(node),
+            'level': node.level,
+            'uid': node.uid,
+            'key': node.key,
+        }
 
-    for child in _children([item]):
-        _set_checked(child, checked)
+    def checked(self, generation):
+        """uids of the checked records of a generation, in the order of the tree"""
+        checked = self._checked[LEVELS[generation-1]]
+        if not checked:
+            return []
+        return [uid for uid in self._descendants('Database', generation) if uid in checked]
 
+    def nrChecked(self, generation):
+        return len(self._checked[LEVELS[generation-1]])
 
-def _children(items):
+    def isChecked(self, uid):
+        return any(uid in checked for checked in self._checked.values())
 
-    children = []
-    for item in items:
-        cnt = item.childCount()
-        children += [item.child(i) for i in range(cnt)]
-    return children
\ No newline at end of file
+    def setChecked(self, uid, checked):
+        """Check or uncheck a record and all its descendants"""
+        if uid == 'Database' and not checked:
+            changed = set().union(*self._checked.values())
+            for uids in self._checked.values():
+                uids.clear()
+        else:
+            if uid != 'Database' and uid not in self._records:
+                return
+            changed = []
+            uids = [uid]
+            while uids != []:
+                changed += uids
+                uids = [child for uid in uids for child in self._children.get(uid, [])]
+            for uid in changed:
+                if uid in self._records:
+                    level = self._records[uid][0]
+                    if checked:
+                        self._checked[level].add(uid)
+                    else:
+                        self._checked[level].discard(uid)
+        for uid in changed:
+            node = self._nodes.get(uid)
+            if node is not None:
+                index = self._index(node)
+                self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self._node(parent)
+        if node.children is None or not (0 <= row < len(node.children)):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self._index(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        node = self._node(parent)
+        return 0 if node.children is None else len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if node.children is not None:
+            return node.children != []
+        return self._children.get(node.uid, []) != []
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return node.children is None and self._children.get(node.uid, []) != []
+
+    def fetchMore(self, parent):
+        self._fetch(self._node(parent), signal=True)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return self._label(node)
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if node.uid in self._checked[node.level] else Qt.Unchecked
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole:
+            return False
+        node = index.internalPointer()
+        self.setChecked(node.uid, value == Qt.Checked)
+        self.toggled = node
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.root.label
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def _index(self, node):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def _label(self, node):
+        if node.label is None:
+            node.label = self._database.manager.label(key=node.key, type=node.level)
+        return node.label
+
+    def _readRegister(self, patients=None):
+        # This does not show empty patients or studies
+        df = self._database.manager.register
+        if df is None:
+            raise ValueError('Cannot build tree - no database open')
+        if patients is not None:
+            df = df[df.PatientID.isin(patients)]
+        df = df[df.removed == False]
+        # One row per series, in the order of the tree
+        df = df.drop_duplicates(subset=UIDS).dropna(subset=UIDS)
+        df = df.sort_values(['PatientName','StudyDate','SeriesNumber','InstanceNumber'])
+        children = {'Database': []}
+        records = {}
+        parents = {}
+        keys = df.index.tolist()
+        for i, level in enumerate(LEVELS):
+            uids = df[UIDS[i]].tolist()
+            parent_uids = ['Database']*len(keys) if i == 0 else df[UIDS[i-1]].tolist()
+            labels = zip(*[df[c].tolist() for c in LABELS[i]])
+            for key, uid, parent, label in zip(keys, uids, parent_uids, labels):
+                if uid in records:
+                    continue
+                records[uid] = (level, key, tuple(str(v) for v in label))
+                parents[uid] = parent
+                children.setdefault(parent, []).append(uid)
+        if patients is None:
+            self._children, self._records, self._parents = children, records, parents
+            self._forgetChecked()
+            return
+        # Replace the records of these patients only
+        new = children.pop('Database')
+        # Patients keep their place unless they are gone or renamed
+        top = [
+            uid for uid in self._children['Database'] 
+            if uid not in patients or (uid in records and records[uid][2] == self._records[uid][2])
+        ]
+        for uid in patients:
+            self._forget(uid)
+        self._records.update(records)
+        self._parents.update(parents)
+        self._children.update(children)
+        # New patients are inserted in order of name
+        for uid in new:
+            if uid in top:
+                continue
+            name = records[uid][2]
+            row = next((i for i, u in enumerate(top) if self._records[u][2] > name), len(top))
+            top.insert(row, uid)
+        self._children['Database'] = top
+        self._forgetChecked()
+
+    def _forgetChecked(self):
+        # Records that are no longer in the database are not checked
+        for level, checked in self._checked.items():
+            self._checked[level] = {uid for uid in checked if uid in self._records}
+
+    def _forget(self, uid):
+        if uid not in self._records:
+            return
+        for child in self._children.pop(uid, []):
+            self._forget(child)
+        del self._records[uid]
+        del self._parents[uid]
+
+    def _top(self, uid):
+        # uid of the patient that a record belongs to
+        while uid in self._parents and self._parents[uid] != 'Database':
+            uid = self._parents[uid]
+        return uid if uid in self._parents else None
+
+    def _newNode(self, uid, parent):
+        level, key, label = self._records[uid]
+        node = _Node(level, uid, key, parent)
+        node.fields = label
+        self._nodes[uid] = node
+        return node
+
+    def _dropNode(self, node):
+        if self._nodes.get(node.uid) is node:
+            del self._nodes[node.uid]
+        for child in node.children or []:
+            self._dropNode(child)
+
+    def _fetch(self, node, signal=False):
+        uids = self._children.get(node.uid, [])
+        if signal and uids != []:
+            self.beginInsertRows(self._index(node), 0, len(uids)-1)
+        node.children = [self._newNode(uid, node) for uid in uids]
+        _renumber(node.children)
+        if signal and uids != []:
+            self.endInsertRows()
+
+    def _update(self, node, patients=None):
+        """Update the children of a node to match the register.
+
+        If a set of patients is given, only those are updated below 
+        the database.
+        """
+        if node.children is None:
+            return
+        parent = self._index(node)
+        uids = self._children.get(node.uid, [])
+        new = set(uids)
+        # Remove rows that are no longer in the register
+        for row in reversed(range(len(node.children))):
+            if node.children[row].uid not in new:
+                self.beginRemoveRows(parent, row, row)
+                self._dropNode(node.children.pop(row))
+                self.endRemoveRows()
+        _renumber(node.children)
+        # Put the remaining rows in the order of the register
+        old = {child.uid: child for child in node.children}
+        order = [uid for uid in uids if uid in old]
+        if order != [child.uid for child in node.children]:
+            self.layoutAboutToBeChanged.emit()
+            node.children = [old[uid] for uid in order]
+            _renumber(node.children)
+            for index in self.persistentIndexList():
+                if index.isValid() and index.internalPointer().parent is node:
+                    moved = index.internalPointer()
+                    self.changePersistentIndex(index, self.createIndex(moved.row, index.column(), moved))
+            self.layoutChanged.emit()
+        # Insert new rows
+        for row, uid in enumerate(uids):
+            if row < len(node.children) and node.children[row].uid == uid:
+                continue
+            self.beginInsertRows(parent, row, row)
+            child = self._newNode(uid, node)
+            node.children.insert(row, child)
+            _renumber(node.children)
+            self.endInsertRows()
+        # Update labels and children of the existing rows
+        for child in node.children:
+            level, key, fields = self._records[child.uid]
+            child.key = key
+            if child.fields != fields:
+                child.fields = fields
+                child.label = None
+                index = self._index(child)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+            if patients is None or child.uid in patients:
+                self._update(child)
+
+    def _descendants(self, uid, generation):
+        uids = [uid]
+        for _ in range(generation):
+            uids = [child for uid in uids for child in self._children.get(uid, [])]
+        return uids
+
+
+class _Node():
+    """A row in the tree"""
+
+    __slots__ = ('level', 'uid', 'key', 'parent', 'children', 'row', 'label', 'fields')
+
+    def __init__(self, level, uid, key, parent):
+        self.level = level
+        self.uid = uid
+        self.key = key
+        self.parent = parent
+        self.children = None    # None if not yet created
+        self.row = 0
+        self.label = None
+        self.fields = None
+
+
+def _renumber(nodes):
+    for row, node in enumerate(nodes):
+        node.row = row
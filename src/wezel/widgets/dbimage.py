@@ -71,9 +71,12 @@ class ImageWindow(QWidget):
     def _valueChanged(self):
         self.valueChanged.emit(self.getValue())
 
-    def setData(self, array, center, width, set=None):
-        min = np.amin(array)
-        max = np.amax(array)
+    def setData(self, array, center, width, set=None, stats=None):
+        # stats are the precomputed statistics of the array, if available
+        if stats is None:
+            min, max = np.amin(array), np.amax(array)
+        else:
+            min, max = stats.min(), stats.max()
         if set is None:
             set = not self.mode.isLocked
         self.brightness.setData(min, max, center, set)
@@ -8,7 +8,7 @@ from PyQt5.QtWidgets import (QFileDialog, QLineEdit, QApplication,
 
 import pydicom
 import pandas as pd
-from wezel import MainWidget
+from wezel import MainWidget, headers
 
 
 localStyleSheet = """
@@ -100,7 +100,7 @@ class SeriesViewerMetaData(MainWidget):
         if instances == []:
             self.setError('Series ' + series.label() + ' is empty. \n\n Nothing to show here..')
             return 
-        self._objectDICOM = instances[0].get_dataset()
+        self._objectDICOM = headers.read_header(instances[0])
         self._series = series
 
         layout = QVBoxLayout()
@@ -4,11 +4,30 @@ on the GUI from a calculation running in its own thread.
 """
 import sys
 import datetime
+import threading
 import traceback
 from PyQt5.QtCore import (QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot)
 from PyQt5.QtWidgets import (QVBoxLayout, QWidget, QPlainTextEdit)
 
 
+_local = threading.local()
+
+
+class Cancelled(Exception):
+      """Raised in a worker thread when its worker has been cancelled."""
+
+
+def check_cancelled():
+      """
+      Raises Cancelled if this is a worker thread, and its worker has 
+      been cancelled. Long-running functions call this regularly to 
+      allow them to be interrupted.
+      """
+      worker = getattr(_local, 'worker', None)
+      if worker is not None and worker.cancelled:
+          raise Cancelled()
+
+
 class WorkerSignals(QObject):
       """
       Defines the signals available from a running worker thread.
@@ -59,6 +78,15 @@ class Worker(QRunnable):
           # Add the signals object to the kwargs
           kwargs["signals"] = self.signals
           self.kwargs = kwargs
+          self.cancelled = False
+
+
+      def cancel(self):
+          """
+          Asks the calculation to stop. It stops the next time it 
+          calls check_cancelled(), or when it has not started yet.
+          """
+          self.cancelled = True
           
 
       @pyqtSlot()
@@ -68,15 +96,19 @@ class Worker(QRunnable):
           and communicates messages from within this function 
           to the GUI.
           """
+          _local.worker = self
           try:
+            check_cancelled()
             result = self._func(*self.args, **self.kwargs)
-          except Exception:
-              traceback.print_exc()
+          except Exception as e:
+              if not isinstance(e, Cancelled):
+                  traceback.print_exc()
               exctype, value = sys.exc_info()[:2]
               self.signals.error.emit((exctype, value, traceback.format_exc()))
           else:
               self.signals.result.emit(result) # Return the result of the calculation
           finally:
+              _local.worker = None
               self.signals.finished.emit() # Finished
 
 
@@ -1,7 +1,7 @@
 #from ast import literal_eval
 
 from PyQt5 import QtCore
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import (    
     QApplication,                          
@@ -20,9 +20,13 @@ from PyQt5.QtWidgets import (
     QDoubleSpinBox, 
     QLineEdit, 
     QListWidget, 
-    QAbstractItemView 
+    QAbstractItemView,
+    QToolButton,
+    QMenu,
 )
 
+from .log_to_GUI import check_cancelled
+
 
 class Dialog():
 
@@ -113,48 +117,113 @@ class Dialog():
 
 
 class StatusBar(QStatusBar):
+    """
+    Status bar of the main window.
+
+    The methods can also be called from a background job. The 
+    updates are then passed to the GUI thread by signals, and 
+    raise Cancelled when the job has been cancelled.
+    """
+    _hide = pyqtSignal()
+    _message = pyqtSignal(str)
+    _progress = pyqtSignal(int, int, object)
 
     def __init__(self):
         super().__init__()
 
+        self._hide.connect(self._showHide)
+        self._message.connect(self._showMessage)
+        self._progress.connect(self._showProgress)
+
+        self.jobsButton = QToolButton()
+        self.jobsButton.setAutoRaise(True)
+        self.jobsButton.setPopupMode(QToolButton.InstantPopup)
+        self.jobsButton.setToolTip('Running jobs - select a job to cancel it')
+        self.jobsButton.setMenu(QMenu(self.jobsButton))
+        self.jobsButton.hide()
+        self.addPermanentWidget(self.jobsButton)
+
         self.progressBar = QProgressBar()
         self.progressBar.setFixedHeight(10)
         self.addPermanentWidget(self.progressBar)
         self.hide()
 
+    def _inBackground(self):
+        if QThread.currentThread() is self.thread():
+            return False
+        check_cancelled()
+        return True
+
     def hide(self):
 
-        self.message('')
-        self.progressBar.hide()
-        QApplication.processEvents() # allow gui to update
+        if self._inBackground():
+            self._hide.emit()
+        else:
+            self._showHide()
+            QApplication.processEvents() # allow gui to update
 
     def message(self, message=None):
 
         if message == None: 
             message = ''
-        self.showMessage(message)
-        QApplication.processEvents() # allow gui to update
+        if self._inBackground():
+            self._message.emit(message)
+        else:
+            self._showMessage(message)
+            QApplication.processEvents() # allow gui to update
 
     def progress(self, value, total, message=None):
 
+        if self._inBackground():
+            self._progress.emit(int(value), int(total), message)
+        else:
+            self._showProgress(value, total, message)
+            QApplication.processEvents() # allow gui to update - prevent freezing
+
+    def _showHide(self):
+        self.showMessage('')
+        self.progressBar.hide()
+
+    def _showMessage(self, message):
+        self.showMessage(message)
+
+    def _showProgress(self, value, total, message):
         if message is not None: 
-            self.message(message)
+            self.showMessage(message)
         self.progressBar.show()
         self.progressBar.setRange(0, total)
         self.progressBar.setValue(value)
-        QApplication.processEvents() # allow gui to update - prevent freezing
+
+    def setJobs(self, jobs):
+        """
+        Shows the queue of background jobs. Each job has a title 
+        and a cancel() method, the first job in the list is running.
+        """
+        menu = self.jobsButton.menu()
+        menu.clear()
+        if jobs == []:
+            self.jobsButton.hide()
+            return
+        for i, job in enumerate(jobs):
+            state = 'Running' if i == 0 else 'Waiting'
+            action = menu.addAction('Cancel ' + job.title + ' (' + state + ')')
+            action.triggered.connect(job.cancel)
+        self.jobsButton.setText(str(len(jobs)) + ' job(s)')
+        self.jobsButton.show()
 
     def cursorToHourglass(self):
         """
         Turns the arrow shape for the cursor into an hourglass. 
         """   
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        if QThread.currentThread() is self.thread():
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
 
     def cursorToNormal(self):
         """
         Restores the cursor into an arrow after it was set to hourglass 
         """   
-        QApplication.restoreOverrideCursor() 
+        if QThread.currentThread() is self.thread():
+            QApplication.restoreOverrideCursor() 
 
     def pixelValue(self, x, y, array):
         text = ""
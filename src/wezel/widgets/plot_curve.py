@@ -18,6 +18,11 @@ class PlotCurve(QWidget):
         self.yLim = None
        
         self.subPlot = self.figure.add_subplot(111)
+        self._line = None
+        self._marker = None
+        self._axesDrawn = None
+        self._background = None
+        self.canvas.mpl_connect('draw_event', self._onDraw)
 
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
@@ -45,9 +50,39 @@ class PlotCurve(QWidget):
 
     def clear(self):
         self.subPlot.clear()
+        self._line = None
+        self._marker = None
         self.canvas.draw()
 
     def setData(self, x, y, index=None):
+        # If the axes have not changed, only the curve is redrawn 
+        # on top of the cached background.
+        if self._line is None or self._axes() != self._axesDrawn:
+            self._drawAxes(x, y)
+        self._line.set_data(x, y)
+        if index is None:
+            self._marker.set_data([], [])
+        else:
+            self._marker.set_data([x[index]], [y[index]])
+        if self._blit():
+            self.canvas.restore_region(self._background)
+            self._drawCurve()
+            self.canvas.blit(self.subPlot.bbox)
+        else:
+            # Without limits the axes are scaled to the data
+            self.subPlot.relim()
+            self.subPlot.autoscale_view()
+            self.canvas.draw()
+
+    def _axes(self):
+        xLim = None if self.xLim is None else tuple(self.xLim)
+        yLim = None if self.yLim is None else tuple(self.yLim)
+        return (xLim, yLim, self.xLabel, self.yLabel)
+
+    def _blit(self):
+        return (self.xLim is not None) and (self.yLim is not None) and (self._background is not None)
+
+    def _drawAxes(self, x, y):
         self.subPlot.clear()
         self.subPlot.tick_params(
             axis='both', 
@@ -64,7 +99,21 @@ class PlotCurve(QWidget):
             self.yLabel, loc='center', 
             fontsize=10)
         self.subPlot.grid()
-        self.subPlot.plot(x, y)
-        if index is not None:
-            self.subPlot.plot(x[index], y[index], 'bo')
-        self.canvas.draw()
+        animated = (self.xLim is not None) and (self.yLim is not None)
+        self._line, = self.subPlot.plot(x, y, animated=animated)
+        self._marker, = self.subPlot.plot([], [], 'bo', animated=animated)
+        self._axesDrawn = self._axes()
+        self._background = None
+        if animated:
+            self.canvas.draw()
+
+    def _drawCurve(self):
+        self.subPlot.draw_artist(self._line)
+        self.subPlot.draw_artist(self._marker)
+
+    def _onDraw(self, event):
+        # Cache everything except the curve
+        if self._line is None or not self._line.get_animated():
+            return
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._drawCurve()
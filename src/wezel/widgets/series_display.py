@@ -1,19 +1,30 @@
+import os
+import threading
 import numpy as np
 
+from PyQt5.QtCore import QObject, QThreadPool, QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
     QWidget, 
     QSplitter,
     QVBoxLayout,
 )
 
-from wezel import widgets, canvas, MainWidget
+from wezel import widgets, canvas, cache, headers, jobs, MainWidget
+from wezel.canvas.series_canvas import series_sources, read_source
+from wezel.widgets.log_to_GUI import Worker
 
 
 class SeriesDisplay(MainWidget):
 
-    def __init__(self):
+    def __init__(self, cacheSize=256*2**20, prefetch=4):
         super().__init__()
         self.toolBarClass = canvas.ToolBar
+        self.prefetchCount = prefetch
+        self._lastKey = 'up'
+
+        # Cache of decoded images
+        self.cache = cache.SliceCache(cacheSize)
+        self.prefetcher = cache.SlicePrefetcher(self.cache)
 
         # Widgets
         self.sliders = widgets.SeriesSliders()
@@ -42,6 +53,8 @@ class SeriesDisplay(MainWidget):
             self.canvas.saveMask()
 
     def closeEvent(self, event):
+        self.prefetcher.cancel()
+        self.canvas.saveMask()
         newSeries = self.canvas._model.saveRegions()
         if newSeries:
             self.databaseUpdated.emit()
@@ -53,56 +66,66 @@ class SeriesDisplay(MainWidget):
         if series.instances() == []:
             self.setError('Series ' + series.label() + ' is empty. \n\n Nothing to show here..')
             return
+        self.prefetcher.cancel()
+        self.cache.clear()
         self.sliders.setData(series)
         self.canvas._model._series = series
         image = self.sliders.image
         if image is None:
             return
-        image.read()
-        array = image.array()
-        if array is None:
+        slice = self.slice(image)
+        if slice['array'] is None:
             self.setError('Series ' + series.label() + ' does not contain images. \n\n Nothing to show here..')
-            image.clear()
             return
         self.canvas.setArray(
-            array,
-            image.SOPInstanceUID, 
-            image.WindowCenter, 
-            image.WindowWidth, 
-            image.colormap,
+            slice['array'],
+            image.uid, 
+            slice['center'], 
+            slice['width'], 
+            slice['colormap'],
         )
-        image.clear()
+        self.prefetch()
 
     def slidersChanged(self):
         image = self.sliders.image
         if image is None:
             return
-        image.read()
-        self.canvas.changeArray(
-            image.array(), 
-            image.SOPInstanceUID, 
-            image.WindowCenter, 
-            image.WindowWidth, 
-            image.colormap,
-        )
-        image.clear()
+        self.changeArray(image)
         
     def arrowKeyPress(self, key):
+        self._lastKey = key
         image_before = self.sliders.image
         self.sliders.move(key=key)
         image_after = self.sliders.image
         if image_after != image_before:
             if image_after is None:
                 return
-            image_after.read()
-            self.canvas.changeArray(
-                image_after.array(), 
-                image_after.SOPInstanceUID, 
-                image_after.WindowCenter, 
-                image_after.WindowWidth, 
-                image_after.colormap,
-            )
-            image_after.clear()
+            self.changeArray(image_after)
+
+    def changeArray(self, image):
+        slice = self.slice(image)
+        self.canvas.changeArray(
+            slice['array'], 
+            image.uid, 
+            slice['center'], 
+            slice['width'], 
+            slice['colormap'],
+        )
+        self.prefetch()
+
+    def slice(self, image):
+        """Return the decoded image, from the cache if possible"""
+        slice = self.cache.get(image.uid)
+        if slice is None:
+            slice = cache.read_slice(image)
+            self.cache.set(image.uid, slice)
+        return slice
+
+    def prefetch(self):
+        """Start loading the next images in the direction of travel"""
+        if self.prefetchCount > 0:
+            images = self.sliders.neighbours(self._lastKey, self.prefetchCount)
+            self.prefetcher.prefetch(images)
 
 
 class SeriesDisplayView():
@@ -126,6 +149,13 @@ class SeriesDisplay4D(MainWidget):
 
         self.x = None
         self.y = None
+        self.model = None
+
+        # Coalesce hover updates to one per display frame
+        self.hoverTimer = QTimer()
+        self.hoverTimer.setSingleShot(True)
+        self.hoverTimer.setInterval(16)
+        self.hoverTimer.timeout.connect(self.hoverUpdate)
 
         # Toolbar
         #self.toolBarClass = canvas.ToolBar
@@ -156,6 +186,10 @@ class SeriesDisplay4D(MainWidget):
             self.canvas.saveMask()
 
     def closeEvent(self, event):
+        self.hoverTimer.stop()
+        if self.model is not None:
+            self.model.cancel()
+        self.canvas.saveMask()
         newSeries = self.canvas._model.saveRegions()
         if newSeries:
             self.databaseUpdated.emit()
@@ -163,13 +197,13 @@ class SeriesDisplay4D(MainWidget):
     def imageChanged(self):
         z = self.viewSlider.value()
         t = self.plotSlider.value()
+        self.model.setSlice(z)
         self.canvas.changeArray(
-            np.squeeze(self.array[:,:,z,t]),
-            self.uid[z,t], 
-            self.center[z,t], 
-            self.width[z,t], 
-            # self.lut[z,t], 
-            self.colormap[z,t],
+            self.model.frame(z,t),
+            self.model.uid[z,t], 
+            self.model.center[z,t], 
+            self.model.width[z,t], 
+            self.model.colormap[z,t],
         )
         self.setStatus()
         self.setPlot() 
@@ -192,9 +226,24 @@ class SeriesDisplay4D(MainWidget):
     def mouseMoved(self, x, y):
         self.x = x
         self.y = y
+        if not self.hoverTimer.isActive():
+            self.hoverTimer.start()
+
+    def hoverUpdate(self):
         self.setStatus()
         self.setPlot()
 
+    def frameLoaded(self, z, t):
+        if z == self.viewSlider.value():
+            if not self.hoverTimer.isActive():
+                self.hoverTimer.start()
+
+    def loadProgress(self, loaded, total):
+        if loaded == total:
+            self.series().status.hide()
+        else:
+            self.series().status.progress(loaded, total, 'Loading images..')
+
     def series(self):
         return self.canvas._model._series
 
@@ -202,51 +251,29 @@ class SeriesDisplay4D(MainWidget):
         if series.instances() == []:
             self.setError('Series ' + series.label() + ' is empty. \n\n Nothing to show here..')
             return
+        if self.model is not None:
+            self.model.cancel()
         self.canvas._model._series = series
-        array, header = series.array(sortby, pixels_first=True)
-        if array is None:
+        self.model = SeriesDisplay4DModel(series, sortby)
+        if self.model.shape is None:
             self.setError('Series ' + series.label() + ' does not have images. \n\n Nothing to show here..')
             return
-        series.status.hide()
-        #self.series = series
-        self.array = array[...,0].reshape(array.shape[:4])
+        self.model.frameLoaded.connect(self.frameLoaded)
+        self.model.progress.connect(self.loadProgress)
         self.zlabel = sortby[0]
         self.tlabel = sortby[1]
-        # create index arrays
-        # Unnecessary read of all files
-        d = self.array.shape
-        self.zcoords = np.empty((d[2],d[3]))
-        self.tcoords = np.empty((d[2],d[3]))
-
-        self.uid = np.empty((d[2],d[3]), dtype=object)
-        self.center = np.empty((d[2],d[3]))
-        self.width = np.empty((d[2],d[3]))
-        self.colormap = np.empty((d[2],d[3]), dtype=object)
-
-        variables = sortby + ['SOPInstanceUID', 'WindowCenter', 'WindowWidth', 'colormap']
-        cnt = 0
-        total = d[2]*d[3]
-        for z in range(d[2]):
-            for t in range(d[3]):
-                cnt += 1
-                series.status.progress(cnt, total, 'Reading coordinates..')
-                values = header[z,t,0][variables]
-                self.zcoords[z,t] = values[0]
-                self.tcoords[z,t] = values[1]
-                self.uid[z,t] = values[2]
-                self.center[z,t] = values[3]
-                self.width[z,t] = values[4]
-                self.colormap[z,t] = values[5]
-        series.status.hide()
-
-        self.viewSlider.setMaximum(array.shape[2]-1)
-        self.plotSlider.setMaximum(array.shape[3]-1)
+
+        self.viewSlider.setMaximum(self.model.shape[0]-1)
+        self.plotSlider.setMaximum(self.model.shape[1]-1)
         self.plot.setXlabel(self.tlabel)
         self.plot.setYlabel(series.SeriesDescription)
-        self.plot.setXlim([np.amin(self.tcoords), np.amax(self.tcoords)])
-        self.plot.setYlim([np.amin(self.center-self.width/2), np.amax(self.center+self.width/2)])
+        self.plot.setXlim([np.nanmin(self.model.tcoords), np.nanmax(self.model.tcoords)])
+        center = self.model.center
+        width = self.model.width
+        self.plot.setYlim([np.nanmin(center-width/2), np.nanmax(center+width/2)])
 
         self.refresh()
+        self.model.load()
 
     def refresh(self):
         self.setStatus()
@@ -260,28 +287,30 @@ class SeriesDisplay4D(MainWidget):
         y = self.y
         z = self.viewSlider.value()
         t = self.plotSlider.value()
-        if (not (0 <= x < self.array.shape[0]) or
-            not (0 <= y < self.array.shape[1])):
-            msg = self.zlabel + ' = ' + str(self.zcoords[z,t])
-            msg += ', ' + self.tlabel + ' = ' + str(self.tcoords[z,t])
+        zcoord = self.model.zcoords[z,t]
+        tcoord = self.model.tcoords[z,t]
+        if not self.model.contains(x, y):
+            msg = self.zlabel + ' = ' + str(zcoord)
+            msg += ', ' + self.tlabel + ' = ' + str(tcoord)
         else:
-            v = self.array[x,y,z,t]
+            v = self.model.frame(z,t)[x,y]
             msg = 'x = ' + str(x)
             msg += ', y = ' + str(y)
-            msg += ', ' + self.zlabel + ' = ' + str(self.zcoords[z,t])
-            msg += ', ' + self.tlabel + ' = ' + str(self.tcoords[z,t])
+            msg += ', ' + self.zlabel + ' = ' + str(zcoord)
+            msg += ', ' + self.tlabel + ' = ' + str(tcoord)
             msg += ', signal = ' + str(v)
         self.series().status.message(msg)
 
     def setCanvas(self):
         z = self.viewSlider.value()
         t = self.plotSlider.value()
+        self.model.setSlice(z)
         self.canvas.setArray(
-            np.squeeze(self.array[:,:,z,t]),
-            self.uid[z,t], 
-            self.center[z,t], 
-            self.width[z,t], 
-            self.colormap[z,t],
+            self.model.frame(z,t),
+            self.model.uid[z,t], 
+            self.model.center[z,t], 
+            self.model.width[z,t], 
+            self.model.colormap[z,t],
         )
 
     def setPlot(self):
@@ -289,14 +318,183 @@ class SeriesDisplay4D(MainWidget):
             return
         x = self.x
         y = self.y
-        if (not (0 <= x < self.array.shape[0]) or
-            not (0 <= y < self.array.shape[1])):
+        if not self.model.contains(x, y):
             self.plot.clear()
         else:
             z = self.viewSlider.value()
             t = self.plotSlider.value()
-            self.plot.setData(self.tcoords[z,:], self.array[x,y,z,:], index=t)
+            self.plot.setData(self.model.tcoords[z,:], self.model.curve(x,y,z), index=t)
+
+
+class SeriesDisplay4DModel(QObject):
+    """
+    Lazy 4D array of the images in a series.
+
+    Only the header table is read up front. Images are read when 
+    they are first needed, and the remaining images are loaded 
+    in the background - starting with the current slice. The 
+    background thread reads the files without the database, and
+    waits while a job is running.
+    """
+    frameLoaded = pyqtSignal(int, int)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, series, sortby=['SliceLocation', 'AcquisitionTime']):
+        super().__init__()
+        self.series = series
+        self.sortby = sortby
+        self.shape = None
+        self.frames = None
+        self._z = 0
+        self._curves = None # TimeCurves of slice _curvesSlice
+        self._curvesSlice = None
+        self._stop = False
+        self._lock = threading.Lock()
+        self.threadPool = QThreadPool()
+        self.threadPool.setMaxThreadCount(1)
+        self._readHeaders()
+        if self.shape is None:
+            return
+        self._file = cache.volumes.file(series, sortby, 'frames')
+        frames = cache.volumes.load(self._file)
+        if frames is not None and frames.shape[:2] == self.shape:
+            self.frames = frames
+            self.loaded[:] = True
+
+    def _readHeaders(self):
+        tags = self.sortby + ['SOPInstanceUID', 'WindowCenter', 'WindowWidth', 'colormap']
+        df = headers.read_dataframe(self.series, tags)
+        df = df[df.SOPInstanceUID.notnull()]
+        if df.empty or df[self.sortby].isnull().values.any():
+            return
+        df = df.sort_values(self.sortby)
+        # Keep the first image at each (z, t) position
+        df = df.drop_duplicates(subset=self.sortby)
+        sources = dict(zip(self.series.keys(), series_sources(self.series)))
+        zcoords, z = np.unique(df[self.sortby[0]].values, return_inverse=True)
+        t = df.groupby(self.sortby[0], sort=False).cumcount().values
+        self.shape = (len(zcoords), t.max()+1)
+        self.uid = np.full(self.shape, None, dtype=object)
+        self.source = np.full(self.shape, None, dtype=object)
+        self.colormap = np.full(self.shape, None, dtype=object)
+        self.zcoords = np.full(self.shape, np.nan)
+        self.tcoords = np.full(self.shape, np.nan)
+        self.center = np.full(self.shape, np.nan)
+        self.width = np.full(self.shape, np.nan)
+        self.uid[z,t] = df.SOPInstanceUID.values
+        # Assigned one by one, as datasets would be unpacked into arrays
+        for i, key in enumerate(df.index):
+            self.source[z[i],t[i]] = sources[key]
+        self.colormap[z,t] = df.colormap.values
+        self.zcoords[z,t] = df[self.sortby[0]].values
+        self.tcoords[z,t] = df[self.sortby[1]].values
+        self.center[z,t] = df.WindowCenter.values
+        self.width[z,t] = df.WindowWidth.values
+        # Positions without an image count as loaded (and are zero)
+        self.loaded = self.uid == None
+
+    def frame(self, z, t):
+        """Return the image at position (z,t), reading it if needed"""
+        if self.frames is None:
+            # Read one image to find the image size
+            self._read(*np.argwhere(~self.loaded)[0])
+        if not self.loaded[z,t]:
+            self._read(z, t)
+        return self.frames[z,t,...]
+
+    def curve(self, x, y, z):
+        """Return the pixel values at (x, y) in slice z.
+
+        Images that are not yet loaded are NaN.
+        """
+        with self._lock:
+            if self._curvesSlice != z:
+                self._curves = TimeCurves(self.frames[z,...], self.loaded[z,:])
+                self._curvesSlice = z
+        return self._curves.curve(x, y)
+
+    def contains(self, x, y):
+        if self.frames is None:
+            return False
+        return (0 <= x < self.frames.shape[2]) and (0 <= y < self.frames.shape[3])
+
+    def setSlice(self, z):
+        """Load the images of slice z first"""
+        self._z = z
+
+    def load(self):
+        """Load all images in the background"""
+        if self.loaded.all():
+            return
+        self._stop = False
+        self.threadPool.start(Worker(self._load))
+
+    def cancel(self):
+        self._stop = True
+        self.threadPool.clear()
+        self.threadPool.waitForDone()
+
+    def _load(self, signals=None):
+        total = self.loaded.size
+        percent = None
+        while not self._stop:
+            z = self._z
+            t = np.flatnonzero(~self.loaded[z,:])
+            if t.size > 0:
+                t = t[0]
+            else:
+                todo = np.argwhere(~self.loaded)
+                if todo.size == 0:
+                    break
+                z, t = todo[0]
+            with jobs.reading():
+                self._read(z, t)
+            loaded = int(np.count_nonzero(self.loaded))
+            if 100*loaded//total != percent:
+                percent = 100*loaded//total
+                self.progress.emit(loaded, total)
+        if self.loaded.all():
+            self._save()
+
+    def _read(self, z, t):
+        array = read_source(self.source[z,t]).get_pixel_array()
+        with self._lock:
+            if self.loaded[z,t]:
+                return
+            if self.frames is None:
+                self.frames = np.zeros(self.shape + array.shape, dtype=np.float32)
+            self.frames[z,t,...] = array
+            self.loaded[z,t] = True
+            if self._curvesSlice == z:
+                self._curves.setFrame(t, array)
+        self.frameLoaded.emit(int(z), int(t))
+
+    def _save(self):
+        if self._file is not None and not os.path.exists(self._file):
+            cache.volumes.save(self._file, self.frames)
+
+
+class TimeCurves():
+    """
+    Pixel values of a slice stored with time as the fastest index.
+
+    The curve at a pixel is then contiguous in memory, rather than 
+    spread out over all images of the slice.
+    """
+
+    def __init__(self, frames, loaded=None):
+        # frames has dimensions (t, x, y)
+        nt, nx, ny = frames.shape
+        self.array = np.empty((nx, ny, nt), dtype=np.float32)
+        np.copyto(self.array, np.moveaxis(frames, 0, -1))
+        if loaded is not None:
+            self.array[..., ~loaded] = np.nan
+
+    def setFrame(self, t, frame):
+        self.array[..., t] = frame
 
+    def curve(self, x, y):
+        return self.array[x, y, :]
 
 
 class SeriesDisplay4DView():
@@ -325,7 +523,7 @@ class SeriesDisplay4DView():
         splitter = QSplitter()
         splitter.addWidget(leftPanel)
         splitter.addWidget(rightPanel)
-        splitter.setSizes(2*[controller.geometry().width()/2])
+        splitter.setSizes(2*[controller.geometry().width()//2])
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
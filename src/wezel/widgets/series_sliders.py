@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from PyQt5.QtCore import Qt, pyqtSignal
@@ -6,7 +7,7 @@ from PyQt5.QtWidgets import (
     )
 from PyQt5.QtGui import QIcon
 
-from wezel import widgets, icons
+from wezel import widgets, icons, headers
 
 
 class SeriesSliders(QWidget):
@@ -87,22 +88,19 @@ class SeriesSliders(QWidget):
         Drop tags that are not present in every instance. 
         Drop tags that appear only once.
         """
-        # Add all default tags in the registry and get values
+        # Only read the tags that are needed. Tags in the register 
+        # are taken from there, others are read from the headers.
         tags = self.sliderTags.copy()  
+        for tag in ['SOPInstanceUID', 'InstanceNumber']:
+            if tag not in tags:
+                tags.append(tag)
         if self.series is None:
             self.dataFrame = pd.DataFrame([], index=[], columns=tags)
+            self._setIndex()
             return
-        # If all required tags are in the register,
-        # then just extract the register for the series;
-        # else read the data from disk.
-        columns = list(self.series.manager.columns) # Do we need all of these?
-        tags = list(set(tags + columns))
-        # if set(tags) == set(columns): # integrated in dbdicom read_dataframe
-        #     self.dataFrame = self.series.register()
-        # else: 
-        #     self.dataFrame = self.series.read_dataframe(tags)  
-        self.dataFrame = self.series.read_dataframe(tags)  
-        self.dataFrame.sort_values("InstanceNumber", inplace=True)
+        self.dataFrame = headers.read_dataframe(self.series, tags)
+        self.dataFrame = self.dataFrame[self.dataFrame.SOPInstanceUID.notnull()]
+        self.dataFrame = self.dataFrame.sort_values("InstanceNumber")
         #self.dataFrame.dropna(axis=1, inplace=True)  
         #self.dataFrame.reset_index()
         # remove tags with one unique value  
@@ -115,6 +113,49 @@ class SeriesSliders(QWidget):
         for tag in self.sliderTags.copy():
             if tag not in self.dataFrame:
                 self.sliderTags.remove(tag)
+        self._setIndex()
+
+    def _setIndex(self):
+        """Index the dataframe so that images are found without scanning it.
+
+        Each row is identified by its position in the dataframe, and 
+        the values of each slider tag are replaced by integer codes.
+        """
+        self._uids = self.dataFrame.SOPInstanceUID.values
+        self._rows = {uid: row for row, uid in enumerate(self._uids)}
+        self._codes = {}
+        for tag in self.sliderTags:
+            codes, values = pd.factorize(self.dataFrame[tag])
+            self._codes[tag] = (codes, {value: code for code, value in enumerate(values)})
+        self._selections = {}
+
+    def _selection(self, labels):
+        """Images for each combination of values of the tags in labels.
+
+        Returns a dictionary from a tuple of value codes to the list of 
+        SOPInstanceUIDs with those values, and an array with the position 
+        of each row in its list. These are computed once for each 
+        combination of tags.
+        """
+        if labels not in self._selections:
+            n = len(self._uids)
+            if labels == ():
+                groups = {(): self._uids.tolist()}
+                position = np.arange(n)
+            else:
+                codes = np.stack([self._codes[label][0] for label in labels], axis=1)
+                keys, inverse = np.unique(codes, axis=0, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                order = np.argsort(inverse, kind='stable')
+                counts = np.bincount(inverse, minlength=len(keys))
+                start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                position = np.empty(n, dtype=int)
+                position[order] = np.arange(n) - np.repeat(start, counts)
+                groups = {}
+                for key, s, c in zip(keys.tolist(), start, counts):
+                    groups[tuple(key)] = self._uids[order[s:s+c]].tolist()
+            self._selections[labels] = (groups, position)
+        return self._selections[labels]
 
 
     def _setSliderValueLists(self):
@@ -178,63 +219,87 @@ class SeriesSliders(QWidget):
         # Translate keyboard arrow hits to slider movement
         self._blockSignals = True
         if key is not None:
-            if key == 'left':
-                slider = 'first'
-                direction = -1
-            elif key == 'right':
-                slider = 'first'
-                direction = 1
-            elif key == 'up':
-                slider = 'second'
-                direction = 1
-            elif key == 'down':
-                slider = 'second'
-                direction = -1
-        active = self._activeSliders
-        if self.sliders[0].isHidden():
-            if slider == 'first':
-                sldr = active[0]
-                index = sldr.index() + direction
-                if sldr.setIndex(index):
-                    self._sliderValueChanged()
-            else:
-                if len(active) > 1:
-                    sldr = active[1]
+            slider, direction = self._arrowKey(key)
+        sldr = self._movingSlider(slider)
+        if sldr is not None:
+            index = sldr.index() + direction
+            if sldr.setIndex(index):
+                if sldr is self.sliders[0]:
+                    self._mainSliderValueChanged()
                 else:
-                    sldr = active[0]
-                index = sldr.index() + direction
-                if sldr.setIndex(index):
                     self._sliderValueChanged()
+        self._blockSignals = False
 
-        else: # main slider is visible
+    def neighbours(self, key='up', n=1):
+        """
+        Return the next n images in the direction of an arrow key.
 
-            if slider == 'first':
-                sldr = self.sliders[0]
-                index = sldr.index() + direction
-                if sldr.setIndex(index):
-                    self._mainSliderValueChanged()
-            else: 
-                if len(active) > 0:
-                    sldr = active[0]
-                    index = sldr.index() + direction
-                    if sldr.setIndex(index):
-                        self._sliderValueChanged()
-                else:
-                    sldr = self.sliders[0]
-                    index = sldr.index() + direction
-                    if sldr.setIndex(index):
-                        self._mainSliderValueChanged()
-        self._blockSignals = False
+        These are the images that n successive calls to move(key=key) 
+        would select. The sliders are not moved.
+        """
+        if self.image is None:
+            return []
+        slider, direction = self._arrowKey(key)
+        sldr = self._movingSlider(slider)
+        if sldr is None:
+            return []
+        uids = []
+        if sldr is self.sliders[0]:
+            imageUIDs = self._getAllSelectedImages()
+            for step in range(1, n+1):
+                index = sldr.index() + step*direction
+                if not (0 <= index < len(imageUIDs)):
+                    break
+                uids.append(imageUIDs[index])
+        else:
+            for step in range(1, n+1):
+                index = sldr.index() + step*direction
+                if not (0 <= index < len(sldr.values)):
+                    break
+                imageUIDs = self._getAllSelectedImages({sldr.label: sldr.values[index]})
+                if imageUIDs != []:
+                    index = min(self.sliders[0].index(), len(imageUIDs)-1)
+                    uids.append(imageUIDs[index])
+        return [self.series.instance(uid) for uid in uids]
+
+    def _arrowKey(self, key):
+        """Translate an arrow key into a slider and a direction"""
+
+        if key == 'left':
+            return 'first', -1
+        elif key == 'right':
+            return 'first', 1
+        elif key == 'up':
+            return 'second', 1
+        elif key == 'down':
+            return 'second', -1
+
+    def _movingSlider(self, slider):
+        """Return the slider that is moved by the first or second slider"""
 
+        active = self._activeSliders
+        if self.sliders[0].isHidden():
+            if active == []:
+                return
+            if slider == 'first':
+                return active[0]
+            if len(active) > 1:
+                return active[1]
+            return active[0]
+        else: # main slider is visible
+            if slider == 'first':
+                return self.sliders[0]
+            if len(active) > 0:
+                return active[0]
+            return self.sliders[0]
 
     def _setActiveSliderValues(self):
 
         if self.image is None: 
             return
-        find = self.dataFrame.SOPInstanceUID == self.image.uid
-        row = self.dataFrame.loc[find]
+        row = self._rows[self.image.uid]
         for slider in self._activeSliders:
-            value = row[slider.label].values[0]
+            value = self.dataFrame[slider.label].values[row]
             slider.setValue(value)
 
     def _setMainSliderValue(self):
@@ -245,7 +310,8 @@ class SeriesSliders(QWidget):
         if len(imageUIDs) <= 1:
             self.sliders[0].hide()
         else:
-            index = imageUIDs.index(self.image.uid)
+            labels = tuple([slider.label for slider in self._activeSliders])
+            index = self._selection(labels)[1][self._rows[self.image.uid]]
             self.sliders[0].setValue(index)
             self.sliders[0].show()
 
@@ -284,20 +350,27 @@ class SeriesSliders(QWidget):
             self.valueChanged.emit(self.image)
 
 
-    def _getAllSelectedImages(self):
-        """Get the list of all image files selected by the optional sliders"""
+    def _getAllSelectedImages(self, values=None):
+        """Get the list of all image files selected by the optional sliders
+        
+        values is an optional dictionary of slider values that replace 
+        the current values of the sliders with the same label.
+        The list is shared and must not be modified.
+        """
 
-        selection = pd.Series( 
-            index = self.dataFrame.index, 
-            data = self.dataFrame.shape[0] * [True]
-        )
+        if values is None:
+            values = {}
+        labels = []
+        key = []
         for slider in self._activeSliders:
-            sliderSelection = self.dataFrame[slider.label] == slider.value()
-            selection = selection & sliderSelection
-        if not selection.any():
-            return []
-        else:
-            return self.dataFrame.SOPInstanceUID[selection].values.tolist()
+            value = values.get(slider.label, slider.value())
+            code = self._codes[slider.label][1].get(value)
+            if code is None:
+                return []
+            labels.append(slider.label)
+            key.append(code)
+        groups = self._selection(tuple(labels))[0]
+        return groups.get(tuple(key), [])
 
     @property
     def _activeSliders(self):
@@ -2,11 +2,16 @@ import sys
 import os
 import shutil
 import timeit
+import threading
 import numpy as np
+import pandas as pd
+import pydicom
+from PyQt5.QtCore import QModelIndex, QPersistentModelIndex
 from PyQt5.QtWidgets import QApplication, QWidget
 import dbdicom as db
 import wezel
 from wezel import widgets, canvas
+from wezel.canvas import series_canvas
 
 
 datapath = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
@@ -89,6 +94,157 @@ def test_DICOMFolderTree(interactive = True):
     remove_tmp_database(tmp)
 
 
+def folder_database(tmp):
+    # Two patients with two studies of two series each
+    database = db.database(tmp)
+    for p in ['B', 'A']:
+        patient = database.new_patient(PatientName=p)
+        for s in range(2):
+            study = patient.new_study(StudyDescription=p + str(s))
+            for r in range(2):
+                series = study.new_series(SeriesDescription=p + str(s) + str(r))
+                series.set_array(np.zeros((4, 4, 2)), pixels_first=True)
+    database.save()
+    return database
+
+
+def model_rows(model, parent=QModelIndex()):
+    # uids of the rows of a DICOMFolderModel, creating rows as they are expanded
+    if model.canFetchMore(parent):
+        model.fetchMore(parent)
+    rows = []
+    for row in range(model.rowCount(parent)):
+        index = model.index(row, 0, parent)
+        rows.append((index.internalPointer().uid, model_rows(model, index)))
+    return rows
+
+
+def register_rows(database):
+    # uids of the rows of the tree as built by dbdicom, without empty patients or studies
+    tree = database.manager.tree()
+    rows = []
+    for p in tree['patients']:
+        studies = [(s['uid'], [(r['uid'], []) for r in s['series']]) for s in p['studies']]
+        studies = [s for s in studies if s[1] != []]
+        if studies != []:
+            rows.append((p['uid'], studies))
+    return rows
+
+
+def test_DICOMFolderModel():
+
+    tmp = create_tmp_database()
+    database = folder_database(tmp)
+    app = QApplication(sys.argv)
+    model = widgets.dbdatabase.DICOMFolderModel()
+    model.setDatabase(database)
+
+    # Only the patients are created until they are expanded
+    patient = model.index(0, 0)
+    assert model.rowCount(patient) == 0
+    assert model.canFetchMore(patient)
+    assert [model.data(model.index(row, 0)) for row in range(2)] == ['Patient A', 'Patient B']
+    assert model_rows(model) == register_rows(database)
+    assert not model.canFetchMore(patient)
+
+    patients = {p.PatientName: p for p in database.patients()}
+    studies = {s.StudyDescription: s for s in database.studies()}
+    series = {s.SeriesDescription: s for s in database.series()}
+    persistent = QPersistentModelIndex(model.index(1, 0))
+    assert QModelIndex(persistent).internalPointer().uid == patients['B'].uid
+
+    # Rename, copy, delete and move, and refresh after each
+    series['A00'].SeriesDescription = 'Renamed'
+    model.refresh()
+    assert model_rows(model) == register_rows(database)
+    assert 'Renamed' in model.data(model._index(model._nodes[series['A00'].uid]))
+    series['A01'].copy_to(studies['B1'])
+    model.refresh()
+    assert model_rows(model) == register_rows(database)
+    series['B00'].remove()
+    model.refresh()
+    assert model_rows(model) == register_rows(database)
+    studies['B1'].move_to(patients['A'])
+    model.refresh()
+    assert model_rows(model) == register_rows(database)
+
+    # A renamed patient changes place, and persistent indexes follow it
+    patients['B'].PatientName = '0'
+    model.refresh()
+    assert model_rows(model) == register_rows(database)
+    assert persistent.row() == 0
+    assert QModelIndex(persistent).internalPointer().uid == patients['B'].uid
+    assert model.data(model.index(0, 0)) == 'Patient 0'
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_DICOMFolderTree_updateRecords():
+
+    tmp = create_tmp_database()
+    database = folder_database(tmp)
+    app = QApplication(sys.argv)
+    tree = widgets.DICOMFolderTree(database)
+    patients = {p.PatientName: p for p in database.patients()}
+    studies = {s.StudyDescription: s for s in database.studies()}
+    series = {s.SeriesDescription: s for s in database.series()}
+
+    # Refreshing only the records that changed gives the same tree as a full refresh
+    series['B00'].move_to(studies['A1'])
+    tree.updateRecords([series['B00']])
+    full = widgets.dbdatabase.DICOMFolderModel()
+    full.setDatabase(database)
+    assert model_rows(tree._model) == model_rows(full) == register_rows(database)
+    studies['B1'].remove()
+    tree.updateRecords([studies['B1']])
+    full.refresh()
+    assert model_rows(tree._model) == model_rows(full) == register_rows(database)
+    study = patients['B'].studies()[0]
+    study.move_to(patients['A'])
+    tree.updateRecords([study])
+    full.refresh()
+    assert model_rows(tree._model) == model_rows(full) == register_rows(database)
+    assert [tree._model.data(tree._model.index(row, 0)) for row in range(tree._model.rowCount())] == ['Patient A']
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_DICOMFolderTree_selected():
+
+    tmp = create_tmp_database()
+    database = folder_database(tmp)
+    app = QApplication(sys.argv)
+    tree = widgets.DICOMFolderTree(database)
+    patients = {p.PatientName: p for p in database.patients()}
+    studies = {s.StudyDescription: s for s in database.studies()}
+    series = {s.SeriesDescription: s for s in database.series()}
+    generations = ['Patients', 'Studies', 'Series']
+
+    # Counts of checked records agree with the checked records
+    tree.selectRecords(patients['B'].uid)
+    assert [tree.nr_selected(g) for g in generations] == [1, 2, 4]
+    series['B00'].remove()
+    tree.updateRecords([series['B00']])
+    assert [tree.nr_selected(g) for g in generations] == [1, 2, 3]
+    studies['B1'].move_to(patients['A'])
+    tree.updateRecords([studies['B1']])
+    assert [tree.nr_selected(g) for g in generations] == [1, 2, 3]
+    for g in generations:
+        assert tree.nr_selected(g) == len(tree.selected(g))
+    studies['B0'].remove()
+    tree.setDatabase()
+    for g in generations:
+        assert tree.nr_selected(g) == len(tree.selected(g))
+    assert tree.nr_selected(0) == sum([tree.nr_selected(g) for g in generations])
+    tree.uncheck_all()
+    assert [tree.nr_selected(g) for g in generations] == [0, 0, 0]
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
 def test_SeriesSliders(interactive = True):
 
     tmp = create_tmp_database(rider)
@@ -286,12 +442,894 @@ def test_SeriesCanvas(interactive = True):
     #remove_tmp_database(tmp_skull_ct)
 
 
+def test_ImageStatistics():
+
+    array = np.random.normal(0, 1000, (64, 64))
+    for values in ['finite', 'nan']:
+        if values == 'nan':
+            array[np.random.rand(64, 64) < 0.1] = np.nan
+        stats = canvas.ImageStatistics(array)
+        assert np.array_equal(stats.min(), np.amin(array), equal_nan=True)
+        assert np.array_equal(stats.max(), np.amax(array), equal_nan=True)
+        order, sorted = stats.sorted()
+        assert np.array_equal(sorted, np.sort(array, axis=None), equal_nan=True)
+        assert np.array_equal(array.ravel()[order], sorted, equal_nan=True)
+        # NaN values are sorted last, so value ranges never include them
+        finite = np.count_nonzero(np.isfinite(array))
+        assert np.searchsorted(sorted, np.nanmax(array), side='right') == finite
+        q = [0, 1, 25, 50, 99.5, 100]
+        assert np.allclose(stats.percentile(q), np.nanpercentile(array, q))
+        assert np.isclose(stats.percentile(50), np.nanmedian(array))
+    stats = canvas.ImageStatistics(np.arange(10, dtype=np.uint16).reshape(2, 5))
+    assert np.allclose(stats.percentile([0, 55, 100]), [0, 4.95, 9])
+    assert np.isnan(canvas.ImageStatistics(np.full((4, 4), np.nan)).percentile(50))
+
+
+def window_scan(array, center, width):
+    # Float windowing of the full array, for comparison
+    min = center - width/2
+    max = center + width/2
+    array = np.clip(array.astype(np.float64), min, max) - min
+    if max > min:
+        array *= 255/(max-min)
+    return np.transpose(array.astype(np.ubyte))
+
+
+def assert_window(BGRA, array, center, width):
+    # Greyscale display: each colour channel is the windowed value.
+    # Rounding in float32 may move values on a level boundary by one.
+    expected = window_scan(array, center, width).astype(int)
+    for c in range(3):
+        assert np.abs(BGRA[:,:,c].astype(int) - expected).max() <= 1
+    assert np.mean(BGRA[:,:,0] == expected) > 0.99
+
+
+def test_ImageItem_window(nframes=100):
+
+    app = QApplication(sys.argv)
+    lut = canvas.colormap_to_LUT('viridis')
+    for n in [512, 1024]:
+        arrays = {
+            'float': np.random.normal(0, 1000, (n,n)).astype(np.float32),
+            'integer': np.random.randint(-1024, 3072, (n,n)).astype(np.int16),
+        }
+        for values, array in arrays.items():
+            item = canvas.ImageItem(array, 0, 2000, lut)
+            start = timeit.default_timer()
+            for i in range(nframes):
+                item.setWindow(10*i, 2000 + 10*i)
+                item.setDisplay()
+            stop = timeit.default_timer()
+            print('Windowing ' + str(n) + 'x' + str(n) + ' ' + values + ' image (frames/sec)', nframes/(stop-start))
+            item.setLUT(None)
+            item.setDisplay()
+            assert_window(item._BGRA, array, 10*(nframes-1), 2000 + 10*(nframes-1))
+
+
+def test_ImageRenderer():
+
+    n = 256
+    arrays = {
+        'float': (np.random.normal(0, 1000, (n,n)).astype(np.float32), False),
+        'int16': (np.random.randint(-1024, 3072, (n,n)).astype(np.int16), True),
+        'integer floats': (np.random.randint(0, 4096, (n,n)).astype(np.float64), True),
+        # 65536 levels are rendered in the integer domain, 65537 are not
+        '65536 levels': (np.linspace(0, 65535, n*n).round().reshape((n,n)), True),
+        '65537 levels': (np.linspace(0, 65536, n*n).round().reshape((n,n)), False),
+    }
+    for values, (array, integer) in arrays.items():
+        renderer = canvas.ImageRenderer(array)
+        assert (renderer._offset is not None) == integer, values
+        for center, width in [(0, 2000), (1000, 500), (500, 1), (30000, 60000), (100, 0)]:
+            renderer.setWindow(center, width)
+            renderer.render()
+            assert_window(renderer.BGRA, array, center, width)
+
+
+def test_TimeCurves(ncurves=10000):
+
+    app = QApplication(sys.argv)
+    frames = np.random.normal(0, 1000, (200, 256, 256)).astype(np.float32)
+    x = np.random.randint(0, 256, ncurves)
+    y = np.random.randint(0, 256, ncurves)
+
+    start = timeit.default_timer()
+    for i in range(ncurves):
+        curve = np.array(frames[:,x[i],y[i]])
+    stop = timeit.default_timer()
+    print('Curves from 256x256x200 slice, image-major (curves/sec)', ncurves/(stop-start))
+
+    curves = widgets.TimeCurves(frames)
+    start = timeit.default_timer()
+    for i in range(ncurves):
+        curve = np.array(curves.curve(x[i], y[i]))
+    stop = timeit.default_timer()
+    print('Curves from 256x256x200 slice, time-major (curves/sec)', ncurves/(stop-start))
+    for i in range(100):
+        assert np.array_equal(curves.curve(x[i], y[i]), frames[:,x[i],y[i]])
+
+    # Frames that are not loaded yet are NaN until they are set
+    loaded = np.arange(200) % 2 == 0
+    partial = widgets.TimeCurves(frames, loaded)
+    assert np.array_equal(partial.curve(x[0], y[0])[loaded], frames[loaded,x[0],y[0]])
+    assert np.isnan(partial.curve(x[0], y[0])[~loaded]).all()
+    partial.setFrame(1, frames[1,:,:])
+    assert partial.curve(x[0], y[0])[1] == frames[1,x[0],y[0]]
+
+    plot = widgets.PlotCurve()
+    plot.setXlim([0, 200])
+    plot.setYlim([-3000, 3000])
+    t = np.arange(200)
+    nplots = 50
+    start = timeit.default_timer()
+    for i in range(nplots):
+        plot.setData(t, curves.curve(x[i], y[i]), index=100)
+    stop = timeit.default_timer()
+    print('Curve plot updates (updates/sec)', nplots/(stop-start))
+    assert np.array_equal(plot._line.get_ydata(), curves.curve(x[nplots-1], y[nplots-1]))
+    assert plot._marker.get_xdata()[0] == 100
+
+
+def test_MaskItem_undo(nstrokes=500):
+
+    app = QApplication(sys.argv)
+    n = 1024
+    image = canvas.ImageItem(np.zeros((n,n)), 0, 1, None)
+    mask = canvas.MaskItem(image, np.zeros((n,n)))
+    stencil = canvas.brush_stencil(31, 'circle')
+    x, y = n//2, n//2
+    start = timeit.default_timer()
+    for i in range(nstrokes):
+        mask.extend()
+        for j in range(20):
+            x1 = int(np.clip(x + np.random.randint(-10, 11), 0, n-1))
+            y1 = int(np.clip(y + np.random.randint(-10, 11), 0, n-1))
+            mask.setPixels(*canvas.brush_stroke(x, y, x1, y1, stencil), i%4 != 0)
+            x, y = x1, y1
+    stop = timeit.default_timer()
+    print('Brush strokes (strokes/sec)', nstrokes/(stop-start))
+    print('Undo history of ' + str(nstrokes) + ' strokes (MB)', mask._history.nbytes/2**20)
+    print('Full copies of ' + str(nstrokes) + ' masks (MB)', nstrokes*mask.bin().nbytes/2**20)
+
+    final = mask.bin().copy()
+    start = timeit.default_timer()
+    while mask.canUndo():
+        mask.undo()
+    while mask.canRedo():
+        mask.redo()
+    stop = timeit.default_timer()
+    print('Undo and redo all strokes (sec)', stop-start)
+    assert np.array_equal(mask.bin(), final)
+
+
+def test_MaskItem_display():
+
+    app = QApplication(sys.argv)
+    n = 64
+    image = canvas.ImageItem(np.zeros((n,n)), 0, 1, None)
+    mask = canvas.MaskItem(image, None, color=1)
+
+    # A mask can be set before it is initialised
+    bin = np.zeros((n,n), dtype=bool)
+    bin[10:20, 30:40] = True
+    mask.setBin(bin.copy())
+    mask.setDisplay()
+    assert np.array_equal(mask._BGRA[:,:,3] != 0, bin.T)
+
+    # A change of the whole mask is rendered in full,
+    # even if a region is marked as changed afterwards.
+    mask.bin()[:] = np.logical_not(bin)
+    mask.setDirty()
+    mask.setDirty((0, 0, 1, 1))
+    mask.setDisplay()
+    assert np.array_equal(mask._BGRA[:,:,3] != 0, np.logical_not(bin).T)
+
+    # After display only the changed regions are rendered
+    mask.bin()[0:5, 0:5] = False
+    mask.bin()[50:60, 50:60] = False
+    mask.setDirty((0, 0, 5, 5))
+    mask.setDisplay()
+    assert not mask._BGRA[0:5, 0:5, 3].any()
+    assert mask._BGRA[50:60, 50:60, 3].all()
+
+
+def test_MaskThreshold(nmoves=100):
+
+    app = QApplication(sys.argv)
+    n = 512
+    array = np.random.normal(0, 1000, (n,n))
+    cnvs = canvas.Canvas()
+    cnvs.setImage(array, 0, 2000, 'Greyscale')
+    threshold = canvas.MaskThreshold()
+    cnvs.setFilter(threshold)
+    item = cnvs.maskItem
+    changes = []
+    item.maskChanged.connect(lambda: changes.append(1))
+
+    # Drag back and forth in both directions
+    moves = [(3, 5)]*10 + [(-4, -2)]*15 + [(5, -3)]*10 + [(-2, 6)]*10
+    for dx, dy in moves:
+        threshold.window(dx, dy)
+        min, max = threshold.center-threshold.width/2, threshold.center+threshold.width/2
+        assert np.array_equal(item.bin(), (min <= array) & (array <= max))
+    threshold.selected = None
+
+    # Old version: threshold the full image on every move
+    item.extend()
+    start = timeit.default_timer()
+    for i in range(nmoves):
+        threshold.center += 1000/nmoves
+        min, max = threshold.center-threshold.width/2, threshold.center+threshold.width/2
+        item.setBin(np.logical_and(min <= array, array <= max))
+        item.setDisplay()
+    stop = timeit.default_timer()
+    print('Threshold drag ' + str(n) + 'x' + str(n) + ', full image (moves/sec)', nmoves/(stop-start))
+
+    item.extend()
+    changes.clear()
+    start = timeit.default_timer()
+    for i in range(nmoves):
+        threshold.window(0, -1)
+    stop = timeit.default_timer()
+    print('Threshold drag ' + str(n) + 'x' + str(n) + ', incremental (moves/sec)', nmoves/(stop-start))
+    # Only the first move, which sets the whole mask, reports a change
+    assert len(changes) == 1
+
+
+def region_grow_add_loop(img, selected, seed, min, max):
+    # Pixel-by-pixel flood fill, for comparison
+    width, height = img.shape
+    checked = np.copy(selected) 
+    neighbours = [[0, -1], [1, 0], [0, 1], [-1, 0]]
+    while seed != []:
+        p = seed.pop()
+        selected[p[0], p[1]] = True
+        for next in neighbours:
+            x = p[0] + next[0]
+            y = p[1] + next[1]
+            if x < 0 or y < 0 or x >= width or y >= height:
+                continue
+            if not checked[x,y]:
+                checked[x,y] = True
+                if min <= img[x,y] <= max:
+                    seed.append([x,y])
+    return selected
+
+
+def test_region_grow():
+
+    for n in [512, 1024]:
+        # Large homogeneous region with a few holes
+        img = np.random.normal(100, 1, (n,n))
+        img[np.random.rand(n,n) < 0.01] = 0
+        seed = [[n//2, n//2]]
+        selected = np.zeros((n,n), dtype=bool)
+
+        start = timeit.default_timer()
+        loop = region_grow_add_loop(img, selected.copy(), [s.copy() for s in seed], 90, 110)
+        stop = timeit.default_timer()
+        print('Region growing ' + str(n) + 'x' + str(n) + ', pixel loop (sec)', stop-start)
+
+        for connectivity in [4, 8]:
+            start = timeit.default_timer()
+            grown = canvas.region_grow_add(img, selected.copy(), seed, 90, 110, connectivity)
+            stop = timeit.default_timer()
+            print('Region growing ' + str(n) + 'x' + str(n) + ', ' + str(connectivity) + '-connected labelling (sec)', stop-start)
+            if connectivity == 4:
+                assert np.array_equal(grown, loop)
+
+
+def test_Region(nregions=10, nslices=300):
+
+    n = 512
+    x, y = np.ogrid[:n, :n]
+    regions = [canvas.Region(str(r), [255, 0, 0]) for r in range(nregions)]
+    full = [{} for r in range(nregions)] # Full-size masks per slice, for comparison
+    for r, region in enumerate(regions):
+        for z in range(5*r, 5*r+5):
+            disk = (x-n//2)**2 + (y-n//2)**2 < (10*(r+1))**2
+            region.setMask(str(z), disk)
+            full[r][str(z)] = disk
+    print('Regions, cropped and packed (MB)', sum([region.nbytes for region in regions])/2**20)
+    print('Regions, full-size masks (MB)', sum([m.nbytes for f in full for m in f.values()])/2**20)
+
+    # Store the mask of the current slice and get the next, as in SeriesCanvas.changeArray
+    region = regions[-1]
+    slices = [str(z) for z in range(5*(nregions-1), 5*nregions)]
+    for store in ['full', 'packed']:
+        masks = full[-1]
+        mask = region.mask(slices[0])
+        start = timeit.default_timer()
+        for i in range(1, nslices):
+            if store == 'full':
+                masks[slices[(i-1)%5]] = mask
+                mask = masks[slices[i%5]] != 0 # copy made by MaskItem.setData
+            else:
+                region.setMask(slices[(i-1)%5], mask)
+                mask = region.mask(slices[i%5])
+        stop = timeit.default_timer()
+        print('Slice switch, ' + store + ' masks (msec)', 1000*(stop-start)/(nslices-1))
+    for z in slices:
+        assert np.array_equal(region.mask(z), full[-1][z])
+    assert np.array_equal(region.mask(slices[0]), (x-n//2)**2 + (y-n//2)**2 < (10*nregions)**2)
+    region.setMask(slices[0], np.zeros((n,n)))
+    assert not region.mask(slices[0]).any()
+    region.removeMask(slices[0])
+    assert region.mask(slices[0]) is None
+
+
+def test_SeriesCanvas_regions(nedits=200):
+
+    app = QApplication(sys.argv)
+    n = 512
+    arrays = {uid: np.random.rand(n,n) for uid in ['0', '1']}
+    cnvs = canvas.SeriesCanvas()
+    cnvs.setArray(arrays['0'], '0', 0.5, 1, 'Greyscale')
+    cnvs.setMask(None)
+    item = cnvs.maskItem
+    item.extend()
+    assert cnvs.regionNames() == ['New Region']
+    region = cnvs._model._currentRegion
+
+    # Edits are not stored in the region while the image is shown
+    stencil = canvas.brush_stencil(31, 'circle')
+    start = timeit.default_timer()
+    for i in range(nedits):
+        item.setPixels(100+i, 100, stencil, True)
+        item.maskChanged.emit()
+    stop = timeit.default_timer()
+    print('Brush edits with maskChanged (edits/sec)', nedits/(stop-start))
+    assert len(region) == 0
+    edited = item.bin().copy()
+    # For comparison, storing the mask on every edit
+    start = timeit.default_timer()
+    for i in range(nedits):
+        item.setPixels(100+i, 100, stencil, True)
+        region.setMask('0', item.bin())
+    stop = timeit.default_timer()
+    print('Brush edits stored in the region (edits/sec)', nedits/(stop-start))
+    region.removeMask('0')
+
+    # The mask is stored when the image changes, and shown again when it returns
+    cnvs.changeArray(arrays['1'], '1', 0.5, 1, 'Greyscale')
+    assert np.array_equal(region.mask('0'), edited)
+    assert cnvs.maskItem.bin() is None or not cnvs.maskItem.bin().any()
+    cnvs.changeArray(arrays['0'], '0', 0.5, 1, 'Greyscale')
+    assert np.array_equal(cnvs.maskItem.bin(), edited)
+
+
+def test_saveRegions():
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Image')
+    series.set_array(np.random.randint(0, 4096, (64, 48, 4)).astype(np.float32), pixels_first=True)
+    # Instances are not numbered in the order of the register
+    for image, number in zip(series.instances(), [3, 1, 4, 2]):
+        image.InstanceNumber = number
+    database.save()
+
+    app = QApplication(sys.argv)
+    images = series.instances()
+    model = series_canvas.SeriesCanvasModel()
+    model._series = series
+    model.addRegion()
+    masks = {}
+    for image in images[:3]:
+        masks[image.SliceLocation] = np.random.rand(64, 48) > 0.5
+        model.setArray(image.uid, 0, 1, 'Greyscale')
+        model.setMask(masks[image.SliceLocation])
+    assert model.saveRegions()
+
+    # The masks are read back as saved, with 8 uncompressed bits
+    roi = [s for s in database.series() if s.SeriesDescription == 'New Region'][0]
+    saved = roi.instances()
+    assert len(saved) == 3
+    for image in saved:
+        ds = image.get_dataset()
+        assert ds.BitsAllocated == 8
+        assert ds.file_meta.TransferSyntaxUID == pydicom.uid.ExplicitVRLittleEndian
+        assert np.array_equal(ds.get_pixel_array(), masks[image.SliceLocation])
+
+    # Sources with compressed or 1-bit pixels are written uncompressed
+    ds = images[0].get_dataset()
+    ds.file_meta.TransferSyntaxUID = pydicom.uid.JPEGLosslessSV1
+    ds.BitsAllocated = 1
+    mask = np.random.rand(64, 48) > 0.5
+    series_canvas.set_mask_array(ds, mask)
+    file = os.path.join(tmp, 'mask.dcm')
+    ds.save_as(file)
+    assert np.array_equal(pydicom.dcmread(file).pixel_array, mask.T)
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_map_series():
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    image = database.new_series(SeriesDescription='Image')
+    image.set_array(np.random.rand(64, 48, 6), pixels_first=True)
+    mask = database.new_series(SeriesDescription='Mask')
+    array = np.random.rand(64, 48, 6) > 0.5
+    mask.set_array(array.astype(np.float32), pixels_first=True)
+    single = database.new_series(SeriesDescription='Single slice')
+    single.set_array(np.random.rand(64, 48, 1), pixels_first=True)
+    for series in [image, mask, single]:
+        for instance in series.instances():
+            affine = np.diag([1.5, 1.5, 2.0, 1.0])
+            affine[2,3] = 2.0*instance.SliceLocation
+            instance.affine_matrix = affine
+    database.save()
+
+    # The geometry is the same as in dbdicom
+    for series in [image, single]:
+        groups = series_canvas.slice_groups(series_canvas.series_sources(series))
+        affine, images = series.affine_matrix()
+        assert len(groups) == 1
+        assert np.allclose(groups[0][0], affine)
+        assert sorted(groups[0][1]) == sorted([i.uid for i in images])
+
+    # A mask on the same geometry is mapped unchanged
+    sources = series_canvas.series_sources(mask)
+    target, masks = series_canvas.map_series(sources, series_canvas.series_sources(image))
+    assert np.array_equal(masks[0], array)
+    locations = {i.uid: i.SliceLocation for i in image.instances()}
+    for uid, z in zip(target[0][1], target[0][3]):
+        assert locations[uid] == np.unique(list(locations.values()))[z]
+
+    remove_tmp_database(tmp)
+
+
+def select_images_scan(df, values):
+    # Boolean scan over all rows, for comparison
+    selection = pd.Series(index=df.index, data=df.shape[0]*[True])
+    for tag, value in values.items():
+        selection = selection & (df[tag] == value)
+    return df.SOPInstanceUID[selection].values.tolist()
+
+
+class DataFrameSeries():
+    # Series with the images of a dataframe, without a database
+    def __init__(self, df):
+        self.df = df
+
+    def instance(self, uid=None):
+        if uid is None:
+            uid = self.df.SOPInstanceUID.values[0]
+        return Image(uid)
+
+
+class Image():
+    def __init__(self, uid):
+        self.uid = uid
+
+    def __eq__(self, other):
+        return isinstance(other, Image) and other.uid == self.uid
+
+
+def slider_dataframe(nz, nt):
+    z, t = np.meshgrid(np.arange(nz, dtype=float), np.arange(nt, dtype=float), indexing='ij')
+    return pd.DataFrame({
+        'SliceLocation': z.ravel(), 
+        'AcquisitionTime': t.ravel(), 
+        'SOPInstanceUID': [str(i) for i in range(nz*nt)],
+        'InstanceNumber': np.arange(nz*nt) + 1,
+    })
+
+
+def dataframe_sliders(df, active=['SliceLocation', 'AcquisitionTime']):
+    # SeriesSliders showing the images of a dataframe
+    sliders = widgets.SeriesSliders()
+    sliders.series = DataFrameSeries(df)
+    sliders.dataFrame = df
+    sliders.sliderTags = ['SliceLocation', 'AcquisitionTime']
+    sliders._setIndex()
+    sliders.slidersButton.setChecked(True)
+    sliders._slidersButtonClicked()
+    for slider in sliders.sliders[1:]:
+        slider.checkBox.blockSignals(True)
+        slider.checkBox.setChecked(slider.label in active)
+        slider.checkBox.blockSignals(False)
+        if slider.label in active:
+            slider.createSlider()
+    sliders._setSliderValueLists()
+    return sliders
+
+
+def test_SeriesSliders_read(nz=10, nt=20):
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Variable flip angle')
+    series.set_array(np.random.rand(32, 32, nz, nt), pixels_first=True)
+    for i, image in enumerate(series.instances()):
+        image.FlipAngle = float(i // nz)
+    database.save()
+
+    # FlipAngle is not in the register and is read from the files
+    app = QApplication(sys.argv)
+    dimensions = ['SliceLocation', 'FlipAngle']
+    tags = dimensions + ['SOPInstanceUID', 'InstanceNumber']
+    assert 'FlipAngle' not in series.manager.columns
+
+    # All columns of the register and the slider tags, as read before
+    start = timeit.default_timer()
+    full = series.read_dataframe(list(set(tags + list(series.manager.columns))))
+    stop = timeit.default_timer()
+    print('Full dataframe of ' + str(nz*nt) + ' images (sec)', stop-start)
+    wezel.headers.clear_cache()
+    start = timeit.default_timer()
+    df = wezel.headers.read_dataframe(series, tags)
+    stop = timeit.default_timer()
+    print('Slider tags of ' + str(nz*nt) + ' images (sec)', stop-start)
+    start = timeit.default_timer()
+    df = wezel.headers.read_dataframe(series, tags)
+    stop = timeit.default_timer()
+    print('Slider tags of ' + str(nz*nt) + ' images, memoized (sec)', stop-start)
+    pd.testing.assert_frame_equal(df, full.loc[df.index, tags], check_dtype=False)
+
+    wezel.headers.clear_cache()
+    start = timeit.default_timer()
+    sliders = widgets.SeriesSliders(series, dimensions=dimensions.copy())
+    stop = timeit.default_timer()
+    print('Time to first image (sec)', stop-start)
+    assert sliders.sliderTags == dimensions
+    assert sliders.image.uid == full.sort_values('InstanceNumber').SOPInstanceUID.values[0]
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_headers_read_files(n=2000):
+
+    # n small files with the same header and different flip angles
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Headers')
+    series.set_array(np.random.rand(4, 4, 1), pixels_first=True)
+    database.save()
+    ds = pydicom.dcmread(series.manager.filepath(series.instances()[0].keys()[0]))
+    files = []
+    for i in range(n):
+        ds.FlipAngle = i
+        ds.SOPInstanceUID = pydicom.uid.generate_uid()
+        files.append(os.path.join(tmp, str(i) + '.dcm'))
+        ds.save_as(files[-1])
+    tags = ['FlipAngle', 'SOPInstanceUID']
+
+    # Threads and the spawn pool of processes read the same values
+    wezel.headers.PROCESS_THRESHOLD = n+1
+    wezel.headers.clear_cache()
+    start = timeit.default_timer()
+    threads = wezel.headers.read_files(files, tags)
+    stop = timeit.default_timer()
+    print('Headers of ' + str(n) + ' files in threads (sec)', stop-start)
+    assert wezel.headers._pool is None
+    wezel.headers.PROCESS_THRESHOLD = n
+    wezel.headers.clear_cache()
+    start = timeit.default_timer()
+    processes = wezel.headers.read_files(files, tags)
+    stop = timeit.default_timer()
+    print('Headers of ' + str(n) + ' files in processes (sec)', stop-start)
+    assert processes.equals(threads)
+    # With one cpu read_files uses threads, so also read in the pool directly
+    values = wezel.headers._read_processes(files, tags)
+    assert wezel.headers._pool is not None
+    assert values == threads.values.tolist()
+    assert processes.FlipAngle.tolist() == list(range(n))
+
+    # Memoized values are read again only for files that have changed
+    start = timeit.default_timer()
+    memo = wezel.headers.read_files(files, tags)
+    stop = timeit.default_timer()
+    print('Headers of ' + str(n) + ' files, memoized (sec)', stop-start)
+    assert memo.equals(threads)
+    stat = os.stat(files[0])
+    ds = pydicom.dcmread(files[0])
+    ds.FlipAngle = 5    # same size
+    ds.save_as(files[0])
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert wezel.headers.read_files(files[:1], tags).FlipAngle[0] == 0
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert wezel.headers.read_files(files[:1], tags).FlipAngle[0] == 5
+    ds.FlipAngle = 6
+    ds.ImageComments = 'Changed size'
+    ds.save_as(files[0])
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert wezel.headers.read_files(files[:1], tags).FlipAngle[0] == 6
+    assert wezel.headers.read_files(files, tags).FlipAngle.tolist()[1:] == list(range(1, n))
+
+    wezel.headers.PROCESS_THRESHOLD = 2000
+    wezel.headers._shutdown()
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_SeriesSliders_neighbours(n=3):
+
+    app = QApplication(sys.argv)
+    df = slider_dataframe(6, 4)
+    for active in [[], ['SliceLocation'], ['AcquisitionTime'], ['SliceLocation', 'AcquisitionTime']]:
+        sliders = dataframe_sliders(df, active)
+        for start in ['0', '9', '23']:
+            for key in ['left', 'right', 'up', 'down']:
+                sliders.setImage(Image(start))
+                next = [image.uid for image in sliders.neighbours(key, n)]
+                moved = []
+                for i in range(n):
+                    before = sliders.image
+                    sliders.move(key=key)
+                    if sliders.image == before:
+                        break
+                    moved.append(sliders.image.uid)
+                assert next == moved, (active, start, key)
+
+
+def test_SliceCache():
+
+    slices = {str(i): {'array': np.zeros((100, 100), dtype=np.float32)} for i in range(10)}
+    nbytes = slices['0']['array'].nbytes
+    slice_cache = wezel.cache.SliceCache(maxBytes=4*nbytes)
+    for uid in ['0', '1', '2', '3']:
+        slice_cache.set(uid, slices[uid])
+    assert len(slice_cache) == 4
+    # Using a slice moves it to the end of the queue
+    assert slice_cache.get('0') is slices['0']
+    slice_cache.set('4', slices['4'])
+    assert '1' not in slice_cache
+    assert ['0', '2', '3', '4'] == [uid for uid in slices if uid in slice_cache]
+    assert slice_cache.nbytes == 4*nbytes
+    # Setting a slice again replaces it
+    slice_cache.set('4', slices['4'])
+    assert slice_cache.nbytes == 4*nbytes
+    # A slice that is larger than the budget is kept on its own
+    slice_cache.set('5', {'array': np.zeros((1000, 1000), dtype=np.float32)})
+    assert len(slice_cache) == 1
+    slice_cache.remove('5')
+    assert slice_cache.nbytes == 0
+    # Slices without pixel data are not stored
+    slice_cache.set('6', {'array': None})
+    assert '6' not in slice_cache
+
+
+def test_SlicePrefetcher():
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Noise')
+    series.set_array(np.random.rand(64, 64, 8), pixels_first=True)
+    database.save()
+
+    app = QApplication(sys.argv)
+    images = series.instances()
+    images[-1].WindowCenter = 10
+    slice_cache = wezel.cache.SliceCache()
+    prefetcher = wezel.cache.SlicePrefetcher(slice_cache)
+    prefetcher.prefetch(images)
+    prefetcher.threadPool.waitForDone()
+    app.processEvents()
+    # Changes are read from the current file of the image
+    assert len(slice_cache) == len(images)
+    assert slice_cache.get(images[-1].uid)['center'] == 10
+    for image in images:
+        slice = wezel.cache.read_slice(image)
+        assert np.array_equal(slice_cache.get(image.uid)['array'], slice['array'])
+        assert slice_cache.get(image.uid)['center'] == slice['center']
+
+    database.restore()
+    remove_tmp_database(tmp)
+
+
+def test_VolumeCache():
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = [database.new_series(SeriesDescription=str(i)) for i in range(3)]
+    for sery in series:
+        sery.set_array(np.random.rand(32, 32, 4), pixels_first=True)
+    database.save()
+    path = os.path.join(create_tmp_database(name='tmp_cache'), 'cache')
+    array = np.zeros((4, 32, 32), dtype=np.float32)
+    volumes = wezel.cache.VolumeCache(path, maxBytes=2.5*array.nbytes)
+
+    # The key depends on the layout and on the files
+    file = volumes.file(series[0], 'frames')
+    assert file == volumes.file(series[0], 'frames')
+    assert file != volumes.file(series[0], 'other')
+    assert volumes.load(file) is None
+    volumes.save(file, array)
+    assert np.array_equal(volumes.load(file), array)
+    stat = os.stat(database.manager.filepath(series[0].keys()[0]))
+    os.utime(database.manager.filepath(series[0].keys()[0]), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert volumes.file(series[0], 'frames') != file
+    series[0].instances()[0].WindowCenter = 10
+    assert volumes.file(series[0], 'frames') not in [None, file]
+
+    # The least recently used file is removed when the cache is full
+    volumes.invalidate()
+    files = [volumes.file(sery, 'frames') for sery in series]
+    for i, f in enumerate(files[:2]):
+        volumes.save(f, array)
+        os.utime(f, (i, i))
+    assert volumes.load(files[0]) is not None
+    volumes.save(files[2], array)
+    assert [os.path.exists(f) for f in files] == [True, False, True]
+
+    # Entries are removed by SeriesInstanceUID
+    volumes.invalidate([series[2].uid])
+    assert not os.path.exists(files[2])
+    volumes.invalidate()
+    assert os.listdir(path) == []
+
+    # With maxBytes=0 nothing is cached, and the module cache can be replaced
+    assert wezel.cache.VolumeCache(path, maxBytes=0).file(series[0], 'frames') is None
+    previous = wezel.cache.set_volumes(path, maxBytes=0)
+    assert wezel.cache.volumes.file(series[0], 'frames') is None
+    wezel.cache.volumes = previous
+
+    # A cache that cannot be written is skipped
+    blocked = os.path.join(path, 'blocked')
+    open(blocked, 'w').close()
+    volumes = wezel.cache.VolumeCache(os.path.join(blocked, 'cache'))
+    file = volumes.file(series[1], 'frames')
+    volumes.save(file, array)
+    assert volumes.load(file) is None
+
+    remove_tmp_database(os.path.dirname(path))
+    remove_tmp_database(tmp)
+
+
+def test_SeriesSliders_index(nz=200, nt=100):
+
+    app = QApplication(sys.argv)
+    df = slider_dataframe(nz, nt)
+    sliders = dataframe_sliders(df)
+
+    values = [{'SliceLocation': float(np.random.randint(nz)), 'AcquisitionTime': float(np.random.randint(nt))} for _ in range(100)]
+    start = timeit.default_timer()
+    for v in values:
+        scan = select_images_scan(df, v)
+    stop = timeit.default_timer()
+    print('Boolean scan of ' + str(nz*nt) + ' rows (msec)', 1000*(stop-start)/len(values))
+    sliders._getAllSelectedImages(values[0])
+    start = timeit.default_timer()
+    for v in values:
+        selection = sliders._getAllSelectedImages(v)
+    stop = timeit.default_timer()
+    print('Indexed lookup of ' + str(nz*nt) + ' rows (msec)', 1000*(stop-start)/len(values))
+    assert selection == scan
+
+
+def test_Action_enabled():
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Noise')
+    series.set_array(np.random.rand(8, 8, 2), pixels_first=True)
+    database.save()
+
+    app = wezel.app()
+    app.open(tmp)
+    main = app.main
+    calls = []
+    class SeriesAction(wezel.Action):
+        def enable(self, app):
+            calls.append(self.text())
+            return app.nr_selected('Series') != 0
+    def menus(parent):
+        menu = parent.menu('Test')
+        menu.action(SeriesAction, text='Lazy')
+        menu.action(SeriesAction, text='Eager', shortcut='Ctrl+T')
+    main.set_menu(menus)
+    menu = main.menuBar()._menus[0]
+    lazy, eager = menu._actions
+
+    # Actions with a shortcut are updated straight away, others when shown
+    assert calls == ['Eager']
+    assert not eager.isEnabled()
+    main.treeView.selectRecords(database.series()[0].uid)
+    main.menuBar().enable()
+    assert calls == ['Eager', 'Eager']
+    assert eager.isEnabled()
+    menu.aboutToShow.emit()
+    assert calls == ['Eager', 'Eager', 'Lazy']
+    assert lazy.isEnabled()
+
+    # The enabled state is cached until the number of selected records changes
+    main.menuBar().enable()
+    menu.aboutToShow.emit()
+    assert calls == ['Eager', 'Eager', 'Lazy']
+    main.treeView.uncheck_all()
+    main.menuBar().enable()
+    menu.aboutToShow.emit()
+    assert calls == ['Eager', 'Eager', 'Lazy', 'Eager', 'Lazy']
+    assert not eager.isEnabled()
+    assert not lazy.isEnabled()
+
+    main.close()
+    remove_tmp_database(tmp)
+
+
+def test_jobs(nslices=40):
+
+    tmp = create_tmp_database()
+    database = db.database(tmp)
+    series = database.new_series(SeriesDescription='Noise')
+    series.set_array(np.random.rand(128, 128, nslices), pixels_first=True)
+    database.save()
+
+    app = wezel.app()
+    app.open(tmp)
+    main = app.main
+    main.treeView.selectRecords(main.database().series()[0].uid)
+    action = wezel.menu.filter.GaussianFilter(main.menuBar())
+    options = {'sigma': 2.0, 'order': 0, 'mode': 'constant', 'cval': 0.0, 'truncate': 4.0}
+
+    # The event loop keeps running while the filter runs in the background
+    start = timeit.default_timer()
+    main.jobs.start(action, options)
+    gap = 0
+    while main.jobs.jobs != []:
+        t = timeit.default_timer()
+        app.QApp.processEvents()
+        gap = max(gap, timeit.default_timer() - t)
+    stop = timeit.default_timer()
+    print('Background filter (sec)', stop-start)
+    print('Longest wait for the event loop (msec)', 1000*gap)
+    assert len(main.database().series()) == 2
+
+    # A cancelled job stops at its next progress update
+    job = main.jobs.start(action, options)
+    main.jobs.cancel(job)
+    main.jobs.wait()
+    assert job.cancelled
+
+    # Nothing else reads the database while a job runs
+    started, release = threading.Event(), threading.Event()
+    class Hold(wezel.Action):
+        def run(self, app):
+            started.set()
+            release.wait()
+    path = os.path.join(create_tmp_database(name='tmp_cache'), 'cache')
+    volumes = wezel.cache.set_volumes(path)
+    series = main.database().series()[0]
+    model = widgets.series_display.SeriesDisplay4DModel(series, ['SliceLocation', 'InstanceNumber'])
+    prefetcher = wezel.cache.SlicePrefetcher(wezel.cache.SliceCache())
+    main.jobs.start(Hold(main.menuBar()), {})
+    started.wait()
+    assert not main.central.isEnabled()
+    assert not main.treeViewDockWidget.isEnabled()
+    model.load()
+    prefetcher.prefetch(series.instances())
+    model.threadPool.waitForDone(500)
+    assert not model.loaded.any()
+    release.set()
+    main.jobs.wait()
+    assert main.central.isEnabled()
+    model.threadPool.waitForDone()
+    prefetcher.threadPool.waitForDone()
+    app.QApp.processEvents()
+    assert model.loaded.all()
+    assert len(prefetcher.cache) == nslices
+    wezel.cache.volumes = volumes
+    remove_tmp_database(os.path.dirname(path))
+
+    main.database().save()
+    main.close()
+    remove_tmp_database(tmp)
+
+
 if __name__ == "__main__":
 
     interactive=True
 
     test_launch()
     # test_DICOMFolderTree(interactive)
+    # test_DICOMFolderModel()
+    # test_DICOMFolderTree_updateRecords()
+    # test_DICOMFolderTree_selected()
     # test_SeriesSliders(interactive)
     # test_SelectImageColorMap(interactive)
     # test_ImageBrightness(interactive)
@@ -300,6 +1338,27 @@ if __name__ == "__main__":
     # test_ImageColors(interactive)
     # test_Canvas(interactive)
     # test_SeriesCanvas(interactive)
+    # test_ImageItem_window()
+    # test_ImageRenderer()
+    # test_ImageStatistics()
+    # test_TimeCurves()
+    # test_MaskItem_undo()
+    # test_MaskItem_display()
+    # test_MaskThreshold()
+    # test_region_grow()
+    # test_Region()
+    # test_SeriesCanvas_regions()
+    # test_saveRegions()
+    # test_map_series()
+    # test_SeriesSliders_index()
+    # test_SeriesSliders_read()
+    # test_headers_read_files()
+    # test_SeriesSliders_neighbours()
+    # test_SliceCache()
+    # test_SlicePrefetcher()
+    # test_VolumeCache()
+    # test_Action_enabled()
+    # test_jobs()
 
 
     print('-----------------------')